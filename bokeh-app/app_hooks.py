@@ -0,0 +1,20 @@
+from .core.metrics import add_to_gauge
+from .core.quarantine_two import default_stocks, default_parameters
+from .helpers import result_store, sample_pool, engine_pool
+from .models.quarantine_two import QuarantineTwo
+
+
+def on_server_loaded(server_context):
+    # The first task forks every process of a pool, later runs and analyses reuse them
+    sample_pool.submit(int).result()
+    engine_pool.start()
+    # Every session opens on the default scenario, so it is in the shared store before the first page load
+    QuarantineTwo(store=result_store).run_scenario(dict(default_stocks), dict(default_parameters))
+
+
+def on_session_created(session_context):
+    add_to_gauge("ncov_active_sessions", 1)
+
+
+def on_session_destroyed(session_context):
+    add_to_gauge("ncov_active_sessions", -1)
@@ -0,0 +1,261 @@
+"""Benchmarks of the engines and the dashboard callbacks, saved as JSON and compared against a baseline.
+
+    cd bokeh-app
+    python benchmarks.py -o baseline.json
+    python benchmarks.py -o current.json --compare baseline.json --threshold 0.2
+
+The comparison lists every benchmark whose time or peak memory grew by more than the threshold, or whose event loop
+delay grew by more than --delay-bound milliseconds, and exits with status 1 when there is any. Times are the median of
+the repeats, peak memory is measured with tracemalloc in a separate, untimed repeat. The "event_loop_delay" benchmarks
+are instead the 99th percentile of how late 1 ms sleeps wake up on the main thread, which stands for the Tornado event
+loop, while runs compute like on the server pools.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from statistics import median
+
+import numpy as np
+
+from core.basic import BasicEngine, BasicVectorEngine
+from core.quarantine_two import QuarantineTwoEngine, QuarantineTwoVectorEngine, QuarantineTwoODEEngine, \
+    QuarantineTwoStochasticEngine, default_stocks, default_parameters
+from core.streams import StreamPool
+
+basic_stocks = {"S": 7278717, "IA": 300, "IPs": 300, "ISHome": 66, "ISHosp": 34}
+basic_parameters = {"R0": 0.304, "SAR": 0.6, "InfAR": 0.5, "TtSO": 5, "SCHR": 0.33, "DR": 0.02, "NDtRI": 14,
+                    "RBR": 0.35, "ICUR": 0.2}
+
+
+def measure(function, repeat):
+    # Median wall time of `repeat` calls, then the peak traced allocation of one more call
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": median(seconds), "min_seconds": min(seconds), "repeat": repeat, "peak_bytes": peak}
+
+
+def engine_benchmarks(days_options, batch_sizes, repeat):
+    results = dict()
+    for days in days_options:
+        P = dict(default_parameters, NumDays=days)
+        basic_arguments = dict(basic_parameters, NumDays=days)
+        runs = {"QuarantineTwoEngine.run": lambda: QuarantineTwoEngine().run(dict(default_stocks), dict(P)),
+                "QuarantineTwoVectorEngine.run": lambda: QuarantineTwoVectorEngine().run(default_stocks, P),
+                "QuarantineTwoODEEngine.run": lambda: QuarantineTwoODEEngine().run(default_stocks, P),
+                "BasicEngine.run": lambda: BasicEngine().run(dict(basic_stocks), **basic_arguments),
+                "BasicVectorEngine.run": lambda: BasicVectorEngine().run(basic_stocks, **basic_arguments)}
+        for name, run in runs.items():
+            results["{} days={}".format(name, days)] = measure(run, repeat)
+
+        for batch_size in batch_sizes:
+            rng = np.random.default_rng(0)
+            batch_P = dict(P, beta=rng.uniform(0.1, 0.5, batch_size))
+            batch_basic_arguments = dict(basic_arguments, R0=rng.uniform(0.1, 0.5, batch_size))
+            runs = {"QuarantineTwoVectorEngine.run_batch": lambda: QuarantineTwoVectorEngine().run_batch(default_stocks,
+                                                                                                         batch_P),
+                    "BasicVectorEngine.run_batch": lambda: BasicVectorEngine().run_batch(basic_stocks,
+                                                                                         **batch_basic_arguments)}
+            for name, run in runs.items():
+                result = measure(run, repeat)
+                result["scenario_days_per_second"] = batch_size * days / result["seconds"]
+                results["{} days={} batch={}".format(name, days, batch_size)] = result
+    return results
+
+
+def dashboard_benchmarks(days_options, repeat):
+    from importlib import import_module
+    from bokeh.application import Application
+    from bokeh.document import Document
+    from bokeh.events import ButtonClick
+    from bokeh.io.doc import set_curdoc
+    from serve import load_app
+
+    handler, package_name = load_app()
+    quarantine_two = import_module(package_name + ".models.quarantine_two")
+    results = dict()
+
+    for days in days_options:
+        P = dict(default_parameters, NumDays=days)
+        dict_engine, vector_engine = QuarantineTwoEngine(), QuarantineTwoVectorEngine()
+        dict_engine.run(dict(default_stocks), dict(P))
+        vector_engine.run(default_stocks, P)
+        for name, engine in (("QuarantineTwoEngine", dict_engine), ("QuarantineTwoVectorEngine", vector_engine)):
+            results["{}.history_as_pandas_df+add_derived_columns days={}".format(name, days)] = measure(
+                lambda: quarantine_two.add_derived_columns(engine.history_as_pandas_df()), repeat)
+
+        model = quarantine_two.QuarantineTwo()
+        model.hist_df = quarantine_two.add_derived_columns(vector_engine.history_as_pandas_df())
+        results["QuarantineTwo.plot_panel first days={}".format(days)] = measure(
+            lambda: (setattr(model, "plot_tabs", None), model.plot_panel()), repeat)
+        results["QuarantineTwo.plot_panel days={}".format(days)] = measure(lambda: model.plot_panel(), repeat)
+
+    # Whole run_and_plot callbacks on a headless session Document, the callbacks a server would schedule on its
+    # event loop are run here until the last day is plotted
+    document = Document()
+    # Next tick callbacks are run in the order they were added, like the server's event loop does. The document keeps
+    # them in a set.
+    pending = deque()
+    document.add_next_tick_callback = pending.append
+    set_curdoc(document)
+    Application(handler).initialize_document(document)
+    run_button = document.get_model_by_id("run-button")
+    beta_input = document.get_model_by_id("beta")
+    days_slider = document.get_model_by_id("NumDays")
+    source = [m for m in document.models if type(m).__name__ == "ColumnDataSource" and "IS-Total" in m.data][0]
+    runs = iter(range(10 ** 9))
+
+    def drain(days):
+        deadline = time.perf_counter() + 60
+        while time.perf_counter() < deadline:
+            while pending:
+                pending.popleft()()
+            if len(source.data["Day"]) == days and not pending:
+                return
+            time.sleep(0.0005)
+        raise RuntimeError("run_and_plot did not finish")
+
+    def click(days, change_inputs):
+        if change_inputs:
+            # A new beta every time, so that neither the session cache nor the shared store has the result
+            beta_input.value = "0.3{:06d}".format(next(runs))
+        run_button._trigger_event(ButtonClick(run_button))
+        drain(days)
+
+    drain(len(source.data["Day"]) or default_parameters["NumDays"])
+    for days in days_options:
+        days_slider.value = days
+        results["run_and_plot days={}".format(days)] = measure(lambda: click(days, True), repeat)
+        results["run_and_plot cached days={}".format(days)] = measure(lambda: click(days, False), repeat)
+    return results
+
+
+def event_loop_delay(runs, interval=0.001):
+    # Percentiles of the lateness of `interval` sleeps on this thread while `runs` compute on as many threads
+    delays = []
+    with ThreadPoolExecutor(max_workers=len(runs)) as pool:
+        futures = [pool.submit(run) for run in runs]
+        while not all(future.done() for future in futures):
+            start = time.perf_counter()
+            time.sleep(interval)
+            delays.append(time.perf_counter() - start - interval)
+        for future in futures:
+            future.result()
+    p50, p99 = np.percentile(delays, [50, 99])
+    return {"seconds": p99, "p50_seconds": p50, "repeat": len(delays), "peak_bytes": 0}
+
+
+def latency_benchmarks(concurrency=4, seconds=1.0):
+    # Runs on threads of this process, each one repeated for `seconds`, and the same runs the way the dashboard runs
+    # them, on a StreamPool that threads wait for. ODE runs use BDF since LSODA solves only one problem at a time in a
+    # process.
+    P = dict(default_parameters, NumDays=760)
+    engines = {"QuarantineTwoVectorEngine": (QuarantineTwoVectorEngine, P),
+               "QuarantineTwoStochasticEngine realizations=1000": (QuarantineTwoStochasticEngine, dict(P, NumDays=200)),
+               "QuarantineTwoODEEngine method=BDF": (partial(QuarantineTwoODEEngine, method="BDF"), P)}
+
+    def repeated(run):
+        def repeat():
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                run()
+        return repeat
+
+    def stream(engine_factory, P):
+        return lambda: all(True for _ in engine_factory().iter_run(dict(default_stocks), dict(P)))
+
+    def pool_stream(engine_factory, P):
+        return lambda: all(True for _ in engine_pool.iter_run(engine_factory, dict(default_stocks), dict(P)))
+
+    engine_pool = StreamPool(max_workers=concurrency)
+    # Fork the workers before timing
+    engine_pool.start()
+    try:
+        runs = {"idle": lambda: time.sleep(seconds)}
+        for name, (engine_factory, engine_P) in engines.items():
+            runs["{} threads".format(name)] = stream(engine_factory, engine_P)
+            runs["{} engine_pool".format(name)] = pool_stream(engine_factory, engine_P)
+        return {"event_loop_delay {} concurrency={}".format(name, concurrency):
+                event_loop_delay([repeated(run)] * concurrency) for name, run in runs.items()}
+    finally:
+        engine_pool.shutdown()
+
+
+def compare(results, baseline, threshold, delay_bound=0.01):
+    # Benchmarks whose time or peak memory grew by more than threshold, as (name, metric, change). Event loop delays
+    # vary too much from run to run for a relative threshold, they are compared by how many seconds their 99th
+    # percentile grew instead.
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        if name.startswith("event_loop_delay"):
+            growth = result["seconds"] - baseline[name]["seconds"]
+            if growth > delay_bound:
+                regressions.append((name, "p99", "{:+.1f} ms over the baseline".format(1000 * growth)))
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            old, new = baseline[name][metric], result[metric]
+            if old > 0 and new / old > 1 + threshold:
+                regressions.append((name, metric, "{:.2f}x the baseline".format(new / old)))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the engines and the dashboard callbacks.")
+    parser.add_argument("-o", "--output", help="JSON file to save the results to")
+    parser.add_argument("--compare", help="baseline JSON file saved by an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative growth reported as a regression")
+    parser.add_argument("--delay-bound", type=float, default=10.0,
+                        help="growth of an event loop delay in ms reported as a regression")
+    parser.add_argument("--days", type=int, nargs="+", default=[10, 100, 365, 760])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 64, 1024])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-dashboard", action="store_true", help="only benchmark the engines, without Bokeh")
+    parser.add_argument("--skip-latency", action="store_true", help="do not time the event loop during runs")
+    args = parser.parse_args(argv)
+
+    results = engine_benchmarks(args.days, args.batch_sizes, args.repeat)
+    if not args.skip_latency:
+        results.update(latency_benchmarks())
+    if not args.skip_dashboard:
+        results.update(dashboard_benchmarks(args.days, args.repeat))
+    for name, result in sorted(results.items()):
+        print("{:<80} {:>10.3f} ms {:>10.1f} KiB".format(name, 1000 * result["seconds"], result["peak_bytes"] / 1024))
+
+    report = {"meta": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.delay_bound / 1000)
+        for name, metric, change in regressions:
+            print("REGRESSION {} {}: {}".format(name, metric, change))
+        if regressions:
+            return 1
+        print("No regressions beyond {:.0%}, or {:g} ms of event loop delay, of {}".format(
+            args.threshold, args.delay_bound, args.compare))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
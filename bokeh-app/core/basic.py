@@ -0,0 +1,130 @@
+from collections import defaultdict
+from itertools import chain
+
+from .metrics import timed
+from .stockflow import Flow, StockFlowModel, StockFlowEngine
+
+# Initial stocks and parameters of the default scenario, as the engines take them
+default_stocks = {"S": 7278717, "IA": 300, "IPs": 300, "ISHome": 66, "ISHosp": 34}
+default_parameters = {"R0": 0.304, "SAR": 0.6, "InfAR": 0.5, "TtSO": 5, "SCHR": 0.33, "DR": 0.02, "NDtRI": 14,
+                      "RBR": 0.35, "ICUR": 0.2, "NumDays": 200}
+
+input_stock_keys = list(default_stocks.keys())
+parameter_keys = list(default_parameters)
+stock_keys = ["S", "IA", "IPs", "ISHome", "ISHosp", "NI", "R", "D"]
+flow_keys = ["Becomes Naturally Immune", "Becomes Asymptomatic", "Becomes Presymptomatic", "Asymptomatic Recovers",
+             "Symptomatic Recovers at Home", "Symptomatic Recovers at Hospital", "Presymptomatic Stays Home to Recover",
+             "Presymptomatic Becomes Hospitalized", "Symptomatic Dies at Hospital", "Symptomatic Dies at Home"]
+auxiliary_keys = ["TotalInfected", "Exposed", "Regular Bed", "ICU", "Ventilator"]
+history_keys = stock_keys + flow_keys + auxiliary_keys
+
+# BasicEngine.compute_flows and update_stocks as flows between stocks. Recoveries at home and at hospital are added to R
+# without being taken out of ISHome and ISHosp, so they come from outside the model.
+basic_spec = StockFlowModel(
+    name="Basic",
+    stocks=stock_keys,
+    input_stocks=input_stock_keys,
+    parameters=parameter_keys,
+    derived_parameters={"total_pop": "S"},
+    auxiliaries=[("TotalInfected", "IA + IPs + ISHome + ISHosp"),
+                 ("Exposed", "S * TotalInfected * R0 / total_pop"),
+                 ("Regular Bed", "ISHosp * RBR"),
+                 ("ICU", "ISHosp * ICUR"),
+                 ("Ventilator", "ISHosp * (1 - RBR - ICUR)")],
+    flows=[
+        Flow("S", "NI", "Exposed * SAR", name=flow_keys[0]),
+        Flow("S", "IA", "Exposed * (1 - SAR) * InfAR", name=flow_keys[1]),
+        Flow("S", "IPs", "Exposed * (1 - SAR) * (1 - InfAR)", name=flow_keys[2]),
+        Flow("IA", "R", "IA / NDtRI", name=flow_keys[3]),
+        Flow(None, "R", "ISHome * (1 - DR) / NDtRI", name=flow_keys[4]),
+        Flow(None, "R", "ISHosp * (1 - DR) / NDtRI", name=flow_keys[5]),
+        Flow("IPs", "ISHome", "IPs * (1 - SCHR) / TtSO", name=flow_keys[6]),
+        Flow("IPs", "ISHosp", "IPs * SCHR / TtSO", name=flow_keys[7]),
+        Flow("ISHosp", "D", "ISHosp * DR / NDtRI", name=flow_keys[8]),
+        Flow("ISHome", "D", "ISHome * DR / NDtRI", name=flow_keys[9]),
+    ],
+    record_flows=True,
+)
+
+
+class BasicEngine:
+    def __init__(self):
+        self.history = defaultdict(list)
+
+    @timed("BasicEngine.run")
+    def run(self, population_initials_dict, R0, SAR, InfAR, TtSO, SCHR, DR, NDtRI, RBR, ICUR, NumDays):
+        S = defaultdict(float)  # STOCKS
+        F = defaultdict(float)  # FLOWS
+        A = defaultdict(float)  # AUXILIARY VARIABLES
+
+        for name, init_value in population_initials_dict.items():
+            S[name] = init_value
+        S["NI"] = 0
+        S["R"] = 0
+        S["D"] = 0
+        total_pop = S["S"]
+
+        for step in range(1, NumDays+1):
+            # Compute Auxiliaries
+            A = self.compute_auxiliaries(A, ICUR, R0, RBR, S, total_pop)
+            # Compute Flows
+            F = self.compute_flows(A, DR, F, InfAR, NDtRI, S, SAR, SCHR, TtSO)
+            # Record History of Each Stock, Flow and Auxiliary Variable
+            self.record_history(S, F, A)
+            # Update Stocks
+            S = self.update_stocks(F, S)
+
+    @timed("BasicEngine.update_stocks")
+    def update_stocks(self, F, S):
+        S["S"] = S["S"] - F["Becomes Naturally Immune"] - F["Becomes Asymptomatic"] - F["Becomes Presymptomatic"]
+        S["NI"] = S["NI"] + F["Becomes Naturally Immune"]
+        S["IA"] = S["IA"] + F["Becomes Asymptomatic"] - F["Asymptomatic Recovers"]
+        S["IPs"] = S["IPs"] + F["Becomes Presymptomatic"] - F["Presymptomatic Stays Home to Recover"] - F["Presymptomatic Becomes Hospitalized"]
+        S["ISHome"] = S["ISHome"] + F["Presymptomatic Stays Home to Recover"] - F["Symptomatic Dies at Home"]
+        S["ISHosp"] = S["ISHosp"] + F["Presymptomatic Becomes Hospitalized"] - F["Symptomatic Dies at Hospital"]
+        S["R"] = S["R"] + F["Asymptomatic Recovers"] + F["Symptomatic Recovers at Home"] + F["Symptomatic Recovers at Hospital"]
+        S["D"] = S["D"] + F["Symptomatic Dies at Hospital"] + F["Symptomatic Dies at Home"]
+        return S
+
+    @timed("BasicEngine.compute_flows")
+    def compute_flows(self, A, DR, F, InfAR, NDtRI, S, SAR, SCHR, TtSO):
+        F["Becomes Naturally Immune"] = A["Exposed"] * SAR
+        F["Becomes Asymptomatic"] = A["Exposed"] * (1 - SAR) * InfAR
+        F["Becomes Presymptomatic"] = A["Exposed"] * (1 - SAR) * (1 - InfAR)
+        F["Asymptomatic Recovers"] = S["IA"] / NDtRI
+        F["Symptomatic Recovers at Home"] = S["ISHome"] * (1 - DR) / NDtRI
+        F["Symptomatic Recovers at Hospital"] = S["ISHosp"] * (1 - DR) / NDtRI
+        F["Presymptomatic Stays Home to Recover"] = S["IPs"] * (1 - SCHR) / TtSO
+        F["Presymptomatic Becomes Hospitalized"] = S["IPs"] * SCHR / TtSO
+        F["Symptomatic Dies at Hospital"] = S["ISHosp"] * DR / NDtRI
+        F["Symptomatic Dies at Home"] = S["ISHome"] * DR / NDtRI
+        return F
+
+    @timed("BasicEngine.compute_auxiliaries")
+    def compute_auxiliaries(self, A, ICUR, R0, RBR, S, total_pop):
+        A["TotalInfected"] = sum([S[key] for key in ["IA", "IPs", "ISHome", "ISHosp"]])
+        A["Exposed"] = S["S"] * A["TotalInfected"] * R0 / total_pop
+        A["Regular Bed"] = S["ISHosp"] * RBR
+        A["ICU"] = S["ISHosp"] * ICUR
+        A["Ventilator"] = S["ISHosp"] * (1 - RBR - ICUR)
+        return A
+
+    @timed("BasicEngine.record_history")
+    def record_history(self, S, F, A):
+        for key, value in chain(S.items(), F.items(), A.items()):
+            self.history[key].append(value)
+
+
+class BasicVectorEngine(StockFlowEngine):
+    """BasicEngine compiled from basic_spec, see StockFlowEngine. Takes the arguments of BasicEngine.run."""
+    def __init__(self):
+        super().__init__(basic_spec)
+
+    def run(self, population_initials_dict, R0, SAR, InfAR, TtSO, SCHR, DR, NDtRI, RBR, ICUR, NumDays):
+        super().run(population_initials_dict, dict(R0=R0, SAR=SAR, InfAR=InfAR, TtSO=TtSO, SCHR=SCHR, DR=DR,
+                                                    NDtRI=NDtRI, RBR=RBR, ICUR=ICUR, NumDays=NumDays))
+
+    def run_batch(self, population_initials_dict, R0, SAR, InfAR, TtSO, SCHR, DR, NDtRI, RBR, ICUR, NumDays):
+        return super().run_batch(population_initials_dict, dict(R0=R0, SAR=SAR, InfAR=InfAR, TtSO=TtSO, SCHR=SCHR,
+                                                                DR=DR, NDtRI=NDtRI, RBR=RBR, ICUR=ICUR,
+                                                                NumDays=NumDays))
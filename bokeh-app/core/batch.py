@@ -0,0 +1,144 @@
+"""Run many QuarantineTwo scenarios from a CSV or JSON file over a process pool.
+
+Every column (CSV) or key (JSON list of objects) is an initial stock or a parameter, anything left out takes its
+default value. Results go to a compressed .npz with the scenario inputs, the headline outputs and optionally the
+daily history of some variables, or to a Parquet file of inputs and headline outputs.
+
+    cd bokeh-app && python -m core.batch scenarios.csv -o results.npz --history IS D --dtype float32
+"""
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .quarantine_two import default_stocks, default_parameters, history_index, headline_output_keys, \
+    headline_outputs, engine_modes
+
+batch_engine_modes = ["vector", "lsoda", "bdf"]
+
+
+def read_scenarios(path):
+    # Columns of input values, keyed by stock or parameter name
+    if path.endswith(".json"):
+        with open(path) as f:
+            rows = json.load(f)
+        if isinstance(rows, dict):
+            rows = rows["scenarios"]
+        keys = sorted(set().union(*rows)) if rows else []
+        columns = {key: [row.get(key, np.nan) for row in rows] for key in keys}
+    else:
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            keys = [key.strip() for key in next(reader)]
+            values = list(zip(*reader))
+        columns = {key: [float(value) if value.strip() else np.nan for value in column]
+                   for key, column in zip(keys, values)} if values else {key: [] for key in keys}
+
+    unknown = set(columns) - set(default_stocks) - set(default_parameters)
+    if unknown:
+        raise ValueError("Unknown stocks or parameters {} in {}".format(sorted(unknown), path))
+    columns = {key: np.asarray(values, dtype=float) for key, values in columns.items()}
+    size = len(next(iter(columns.values()))) if columns else 0
+    scenarios = dict()
+    for key, default in list(default_stocks.items()) + list(default_parameters.items()):
+        values = columns.get(key, np.full(size, np.nan))
+        scenarios[key] = np.where(np.isnan(values), default, values)
+    return scenarios
+
+
+def run_chunk(engine_mode, scenarios, history_keys, dtype):
+    # Runs in a worker, scenarios are the columns of one chunk with a single NumDays
+    engine = engine_modes[engine_mode]()
+    S = {key: scenarios[key] for key in default_stocks}
+    P = {key: scenarios[key] for key in default_parameters if key != "NumDays"}
+    P["NumDays"] = int(scenarios["NumDays"][0])
+    history = engine.run_batch(S, P)
+    outputs = headline_outputs(history)
+    if not history_keys:
+        return outputs, None
+    return outputs, history[..., [history_index[key] for key in history_keys]].astype(dtype)
+
+
+def chunk_indices(num_days, chunk_size):
+    # Scenarios of the same length are batched together, each chunk is one run_batch call in a worker
+    chunks = []
+    for days in np.unique(num_days):
+        indices = np.flatnonzero(num_days == days)
+        chunks += [indices[start:start + chunk_size] for start in range(0, len(indices), chunk_size)]
+    return chunks
+
+
+def run_scenarios(scenarios, engine_mode="vector", history_keys=None, dtype="float64", chunk_size=512,
+                  max_workers=None, progress=None):
+    """Run every scenario and return (headline outputs, histories).
+
+    The headline outputs are (scenarios, headline_output_keys). Histories are (scenarios, days, history_keys), padded
+    with NaN after the last day of shorter scenarios, or None when no history_keys are asked for.
+    """
+    size = len(scenarios["NumDays"])
+    num_days = scenarios["NumDays"].astype(int)
+    outputs = np.empty((size, len(headline_output_keys)))
+    histories = None
+    if history_keys:
+        histories = np.full((size, int(num_days.max(initial=0)), len(history_keys)), np.nan, dtype=dtype)
+
+    chunks = chunk_indices(num_days, chunk_size)
+    done = 0
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        futures = [executor.submit(run_chunk, engine_mode, {key: values[chunk] for key, values in scenarios.items()},
+                                   history_keys, dtype) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            chunk_outputs, chunk_history = future.result()
+            outputs[chunk] = chunk_outputs
+            if chunk_history is not None:
+                histories[chunk, :chunk_history.shape[1]] = chunk_history
+            done += len(chunk)
+            if progress:
+                progress(done, size)
+    return outputs, histories
+
+
+def write_results(path, scenarios, outputs, histories, history_keys):
+    if path.endswith(".parquet"):
+        if histories is not None:
+            raise ValueError("Daily histories can only be written to .npz files")
+        # pandas and a Parquet engine are only needed for this output format
+        import pandas as pd
+        table = pd.DataFrame(scenarios)
+        for i, key in enumerate(headline_output_keys):
+            table[key] = outputs[:, i]
+        table.to_parquet(path)
+        return
+    arrays = {"input_" + key: values for key, values in scenarios.items()}
+    arrays["headline_output_keys"] = np.array(headline_output_keys)
+    arrays["headline_outputs"] = outputs
+    if histories is not None:
+        arrays["history_keys"] = np.array(history_keys)
+        arrays["history"] = histories
+    np.savez_compressed(path, **arrays)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run QuarantineTwo scenarios from a CSV or JSON file.")
+    parser.add_argument("scenarios", help="CSV or JSON file of initial stocks and parameters, one scenario each")
+    parser.add_argument("-o", "--output", required=True, help=".npz or .parquet file to write")
+    parser.add_argument("--engine", default="vector", choices=batch_engine_modes)
+    parser.add_argument("--history", nargs="*", default=[], choices=list(history_index), metavar="KEY",
+                        help="daily values to keep besides the headline outputs, .npz only")
+    parser.add_argument("--dtype", default="float64", choices=["float32", "float64"], help="dtype of the history")
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    scenarios = read_scenarios(args.scenarios)
+    outputs, histories = run_scenarios(scenarios, args.engine, args.history, args.dtype, args.chunk_size,
+                                       args.workers, progress=lambda done, total: print(
+                                           "Ran {}/{} scenarios".format(done, total), flush=True))
+    write_results(args.output, scenarios, outputs, histories, args.history)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import numpy as np
+
+
+def lttb_indices(x, y, n_out):
+    """Indices of the n_out points of (x, y) picked by Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept, the points in between are split into n_out - 2 buckets and each bucket keeps
+    the point making the largest triangle with the point kept before it and the average of the next bucket.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        average_x, average_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        areas = np.abs((x[a] - average_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (average_y - y[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+
+def min_max_indices(x, y, n_out):
+    # The first and last points and the minimum and maximum of n_out // 2 buckets of equal size
+    n = len(x)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+    bucket_size = -(-n // (n_out // 2))
+    buckets = -(-n // bucket_size)
+    padded = np.full(buckets * bucket_size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, bucket_size)
+    # A bucket of NaN only has no minimum, its first point is kept instead
+    filled = np.where(np.isnan(padded).all(axis=1, keepdims=True), 0, padded)
+    offsets = np.arange(buckets) * bucket_size
+    indices = np.concatenate([[0, n - 1], offsets + np.nanargmin(filled, axis=1), offsets + np.nanargmax(filled, axis=1)])
+    return np.unique(np.minimum(indices, n - 1))
+
+
+downsample_methods = {"lttb": lttb_indices, "minmax": min_max_indices}
+
+
+def downsample_indices(x, columns, n_out, method="lttb", window=None):
+    """Sorted indices of the rows of x and columns that draw every column with about n_out points.
+
+    Every column is reduced on its own and the union of the indices is kept, so one ColumnDataSource holds all the
+    columns at their own shape. With a window (x0, x1) of sorted x, the points inside it are reduced to n_out points
+    too and added to the overview of the whole series, which is kept so the plot can be zoomed out again.
+    """
+    reduce = downsample_methods[method]
+    if len(x) <= n_out or not columns:
+        return np.arange(len(x))
+    selected = [reduce(x, y, n_out) for y in columns]
+    if window is not None:
+        # One more point past each end of the window, so lines run to the edges of the plot
+        start = max(int(np.searchsorted(x, window[0], side="left")) - 1, 0)
+        end = min(int(np.searchsorted(x, window[1], side="right")) + 1, len(x))
+        selected += [start + reduce(x[start:end], y[start:end], n_out) for y in columns]
+    return np.unique(np.concatenate(selected))
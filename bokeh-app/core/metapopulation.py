@@ -0,0 +1,147 @@
+"""QuarantineTwo over many regions, coupled by the time their residents spend in other regions.
+
+Regions are read from a CSV file with a "region" column of names and, like the scenarios of core.batch, a column per
+initial stock or parameter that differs between regions. Anything left out takes the value of the scenario it is read
+on top of. Mobility is a CSV file with "source", "target" and "share" columns. Each row is the share of their time the
+residents of source spend in target. Residents spend the rest of their time at home.
+"""
+import csv
+from itertools import islice
+
+import numpy as np
+
+from .metrics import timed
+from .quarantine_two import QuarantineTwoEngine, default_stocks, default_parameters, input_stock_keys, \
+    non_ui_stocks
+
+
+def read_regions(path, S=None, P=None):
+    """Read the regions of a CSV file and return (names, S, P).
+
+    S and P are the scenario of every region, their values are arrays over the regions for the columns of the file
+    and the scalars of the given S and P (the defaults when left out) for the others.
+    """
+    S, P = dict(S or default_stocks), dict(P or default_parameters)
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        keys = [key.strip() for key in next(reader)]
+        rows = [row for row in reader if any(value.strip() for value in row)]
+    unknown = set(keys) - {"region"} - set(S) - set(P)
+    if unknown:
+        raise ValueError("Unknown stocks or parameters {} in {}".format(sorted(unknown), path))
+    if "NumDays" in keys:
+        raise ValueError("NumDays is the same for every region, it cannot be a column of {}".format(path))
+    if not rows:
+        raise ValueError("{} has no regions".format(path))
+
+    columns = {key: [row[i].strip() for row in rows] for i, key in enumerate(keys)}
+    names = columns.pop("region", ["Region {}".format(i + 1) for i in range(len(rows))])
+    if len(set(names)) != len(names):
+        raise ValueError("Region names of {} are not unique".format(path))
+    for key, values in columns.items():
+        scenario = S if key in S else P
+        default = scenario[key]
+        scenario[key] = np.array([float(value) if value else default for value in values])
+    return names, S, P
+
+
+def mobility_matrix(sources, targets, shares, size):
+    """Sparse (size, size) matrix of the share of their time the residents of each region spend in each region.
+
+    Shares from a region to itself are ignored, the diagonal is the time left at home. Shares of the same pair of
+    regions are added up.
+    """
+    from scipy.sparse import coo_matrix, diags
+
+    sources, targets = np.asarray(sources, dtype=int), np.asarray(targets, dtype=int)
+    shares = np.asarray(shares, dtype=float)
+    away = coo_matrix((np.where(sources == targets, 0, shares), (sources, targets)), shape=(size, size)).tocsr()
+    home = 1 - np.asarray(away.sum(axis=1)).ravel()
+    if np.any(shares < 0) or np.any(home < 0):
+        raise ValueError("Mobility shares must be positive and add up to at most 1 for every region")
+    return (away + diags(home)).tocsr()
+
+
+def read_mobility(path, names):
+    # Mobility matrix of the regions `names` from a CSV file of source, target and share
+    index = {name: i for i, name in enumerate(names)}
+    sources, targets, shares = [], [], []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            row = {key.strip(): value.strip() for key, value in row.items()}
+            try:
+                sources.append(index[row["source"]])
+                targets.append(index[row["target"]])
+            except KeyError as e:
+                raise ValueError("Unknown region {} in {}".format(e, path))
+            shares.append(float(row["share"]))
+    return mobility_matrix(sources, targets, shares, len(names))
+
+
+class QuarantineTwoMetapopulationEngine(QuarantineTwoEngine):
+    """QuarantineTwoEngine with every stock an array over regions, coupled through the exposure E.
+
+    `mobility` is the sparse (regions, regions) matrix of mobility_matrix. The residents of a region are exposed in
+    every region they spend time in, to the share of infected among the people present there:
+
+        E[i] = beta[i] * S[i] * sum_j mobility[i, j] * (mobility.T @ TI)[j] / (mobility.T @ N)[j]
+
+    Without travel (the identity matrix) every region runs as its own QuarantineTwoEngine with its own N. A day costs
+    two sparse products, linear in the number of mobility edges, besides the updates over the regions. Parameters
+    are scalars or arrays over the regions. History is (days, regions, record_keys), contiguous along the days.
+    """
+    def __init__(self, mobility, record_keys=None, stride=1, dtype=np.float64):
+        from scipy.sparse import csr_matrix
+
+        self.mobility = csr_matrix(mobility, dtype=float)
+        self.mobility_transpose = self.mobility.T.tocsr()
+        self.num_regions = self.mobility.shape[0]
+        self.present_population = None
+        super().__init__(record_keys, stride, dtype)
+
+    def allocate_history(self, num_days):
+        self.days = range(0, int(num_days), self.stride)
+        self.history = np.empty((len(self.days), self.num_regions, len(self.record_keys)), dtype=self.dtype,
+                                order="F")
+        return self.history
+
+    @timed("QuarantineTwoMetapopulationEngine.run")
+    def run(self, S, P):
+        history = self.allocate_history(P["NumDays"])
+        for row, values in enumerate(islice(self.iter_run(S, P), 0, None, self.stride)):
+            history[row] = values
+
+    def iter_run(self, S, P):
+        # Yields the (regions, record_keys) values of each day as soon as the day is computed
+        regions = (self.num_regions,)
+        S = {name: np.broadcast_to(np.asarray(S.get(name, 0), dtype=float), regions).copy() for name in input_stock_keys}
+        P = {name: value if name == "NumDays" else np.asarray(value, dtype=float) for name, value in P.items()}
+        # Total population of each region is the sum of its initial stocks
+        P["N"] = sum(S.values())
+        self.present_population = self.mobility_transpose @ P["N"]
+        for name in non_ui_stocks:
+            S[name] = np.zeros(regions)
+
+        A = dict()
+        for day in range(int(P["NumDays"])):
+            A = self.compute_auxiliaries(A, S, P)
+            yield np.stack([S[key] if key in S else A[key] for key in self.record_keys], axis=-1)
+            S = self.update_stocks(S, A, P)
+
+    @timed("QuarantineTwoMetapopulationEngine.compute_auxiliaries")
+    def compute_auxiliaries(self, A, S, P):
+        # Total Infected
+        A["TI"] = S["IAS"] + S["IPS"] + S["IS"]
+        # Exposed, to the infected present where the residents of each region spend their time
+        present_infected = self.mobility_transpose @ A["TI"]
+        prevalence = np.divide(present_infected, self.present_population, out=np.zeros(self.num_regions),
+                               where=self.present_population > 0)
+        A["E"] = S["S"] * P["beta"] * (self.mobility @ prevalence)
+        return A
+
+    def history_as_pandas_df(self, region=None):
+        # The history of one region as a view of the buffer, or the sum over all regions
+        import pandas as pd
+        history = self.history.sum(axis=1) if region is None else self.history[:, region, :]
+        return pd.DataFrame(history, columns=self.record_keys, index=pd.RangeIndex(self.days.start, self.days.stop,
+                                                                                   self.days.step), copy=False)
@@ -0,0 +1,160 @@
+"""Latency histograms, counters and gauges of this process, in the Prometheus text format.
+
+Set the environment variable NCOV_METRICS=1 before the app is imported to turn them on (serve.py --metrics does).
+When it is off, `timed` hands back the function it decorates unchanged and the other hooks return at once, so the
+hot paths cost the same as without instrumentation.
+"""
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from functools import wraps
+
+enabled = os.environ.get("NCOV_METRICS", "") not in ("", "0")
+# Upper bounds in seconds, from a tenth of a millisecond to 10 s
+latency_buckets = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+_lock = threading.Lock()
+_histograms = defaultdict(lambda: [[0] * (len(latency_buckets) + 1), 0.0])
+_counters = Counter()
+_gauges = Counter()
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    if not enabled:
+        return
+    with _lock:
+        histogram = _histograms[name, _labels(labels)]
+        histogram[0][bisect_left(latency_buckets, seconds)] += 1
+        histogram[1] += seconds
+
+
+def increment(name, amount=1, **labels):
+    if not enabled:
+        return
+    with _lock:
+        _counters[name, _labels(labels)] += amount
+
+
+def add_to_gauge(name, amount, **labels):
+    if not enabled:
+        return
+    with _lock:
+        _gauges[name, _labels(labels)] += amount
+
+
+def timed(function_name):
+    """Decorator observing the latency of every call in ncov_function_seconds{function=function_name}."""
+    def decorate(function):
+        if not enabled:
+            return function
+
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe("ncov_function_seconds", time.perf_counter() - start, function=function_name)
+        return timed_function
+    return decorate
+
+
+def _format_labels(labels, **extra):
+    labels = list(labels) + sorted(extra.items())
+    if not labels:
+        return ""
+    return "{{{}}}".format(",".join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels))
+
+
+def render():
+    lines = []
+    with _lock:
+        histograms, counters, gauges = dict(_histograms), dict(_counters), dict(_gauges)
+        histograms = {key: (list(counts), total) for key, (counts, total) in histograms.items()}
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({name for name, _ in values}):
+            lines.append("# TYPE {} {}".format(name, kind))
+            lines += ["{}{} {}".format(name, _format_labels(labels), value)
+                      for (key, labels), value in sorted(values.items()) if key == name]
+    for name in sorted({name for name, _ in histograms}):
+        lines.append("# TYPE {} histogram".format(name))
+        for (key, labels), (counts, total) in sorted(histograms.items()):
+            if key != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(latency_buckets + ["+Inf"], counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(name, _format_labels(labels, le=bound), cumulative))
+            lines.append("{}_sum{} {}".format(name, _format_labels(labels), total))
+            lines.append("{}_count{} {}".format(name, _format_labels(labels), cumulative))
+    return "\n".join(lines) + "\n"
+
+
+def metrics_handler():
+    # Tornado handler serving render(), for Server(extra_patterns=[("/metrics", metrics_handler())])
+    from tornado.web import RequestHandler
+
+    class MetricsHandler(RequestHandler):
+        def get(self):
+            self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.write(render())
+
+    return MetricsHandler
+
+
+class SamplingProfiler:
+    """Samples the stacks of the watched threads every `interval` seconds into folded stacks.
+
+    The output of `dump` has one "frame;frame;...;frame count" line per distinct stack, the input format of
+    flamegraph.pl and speedscope.
+    """
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.thread_ids = set()
+        self.stacks = Counter()
+        self.running = False
+        self.thread = None
+
+    def watch_current_thread(self):
+        self.thread_ids.add(threading.get_ident())
+
+    def unwatch_current_thread(self):
+        self.thread_ids.discard(threading.get_ident())
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def sample(self):
+        while self.running:
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename),
+                                                     code.co_firstlineno))
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("{} {}\n".format(stack, count))
+        return path
@@ -0,0 +1,174 @@
+from collections import defaultdict
+from functools import partial
+
+import numpy as np
+
+from .metrics import timed
+from .stochastic import StockFlowTauLeapEngine
+from .stockflow import Flow, HistoryRecorder, StockFlowModel, StockFlowEngine, StockFlowODEEngine
+
+# Initial stocks and parameters of the default scenario, as the engines take them
+default_stocks = {"S": 7278717, "NI_RNT": 10, "IAS": 10, "IPS": 10, "IS": 10}
+default_parameters = {"beta": 0.304, "x": 1e-5, "y": 0.5, "t_d": 3.0, "t_i": 14.0, "t_l": 1.0, "t_p": 4.0, "t_c": 1.0,
+                      "p_sa": 1.0, "p_a": 0.6, "p_r": 0.98, "NumDays": 200}
+
+input_stock_keys = list(default_stocks.keys())
+non_ui_stocks = ["S_TWR", "NI_TWR", "IA_TWR", "IPS_TWR", "IS_TWR", "IAS_CCP", "IPS_CCP", "IS_CCP", "D", "RWT"]
+all_stock_keys = input_stock_keys + non_ui_stocks
+auxiliary_keys = ["TI", "E"]
+history_keys = all_stock_keys + auxiliary_keys
+history_index = {key: i for i, key in enumerate(history_keys)}
+headline_output_keys = ["IS-Max", "IS-AUC", "D-Final"]
+# Sums of stocks the dashboard plots, the stochastic engine takes their percentiles over its realizations
+derived_keys = {"NI/RNT+RWT": "NI_RNT + RWT", "IS-Total": "IS + IS_TWR + IS_CCP"}
+
+# Eq [1]-[15] of QuarantineTwoEngine.update_stocks as flows between stocks, a stock's update is its inflows minus its
+# outflows. Splits such as the exposure E into NI_RNT and IPS are one flow per target.
+quarantine_two_spec = StockFlowModel(
+    name="Quarantine #2",
+    stocks=all_stock_keys,
+    input_stocks=input_stock_keys,
+    parameters=list(default_parameters),
+    # Total population is the sum of each initial stock that comes from the UI
+    derived_parameters={"N": "S + NI_RNT + IAS + IPS + IS"},
+    auxiliaries=[("TI", "IAS + IPS + IS"),
+                 ("E", "S * TI * beta / N")],
+    flows=[
+        Flow("S_TWR", "S", "S_TWR / t_d"),
+        Flow("S", "S_TWR", "x * S"),
+        Flow("S", "NI_RNT", "(1 - p_sa) * E"),
+        Flow("S", "IPS", "p_sa * E"),
+        Flow("IAS", "NI_RNT", "IAS / t_i"),
+        Flow("IS", "NI_RNT", "p_r * IS / t_i"),
+        Flow("NI_TWR", "NI_RNT", "NI_TWR / t_d"),
+        Flow("NI_RNT", "NI_TWR", "x * NI_RNT"),
+        Flow("IPS", "IPS_TWR", "x * IPS"),
+        Flow("IPS", "IAS", "p_a * IPS / t_p"),
+        Flow("IPS", "IS", "(1 - p_a) * IPS / t_p"),
+        Flow("IAS", "IA_TWR", "x * IAS"),
+        Flow("IS", "D", "(1 - p_r) * IS / t_i"),
+        Flow("IS", "IS_TWR", "y * IS"),
+        Flow("IA_TWR", "IAS_CCP", "IA_TWR / t_d"),
+        Flow("IA_TWR", "RWT", "IA_TWR / t_i"),
+        Flow("IPS_TWR", "IPS_CCP", "IPS_TWR / t_d"),
+        # Eq [8]-[10] leave IPS_TWR at rate IPS_TWR / t_p but split it with p_a and p_sa, so these are not one flow
+        Flow("IPS_TWR", None, "IPS_TWR / t_p"),
+        Flow(None, "IA_TWR", "p_a * IPS_TWR / t_p"),
+        Flow(None, "IS_TWR", "(1 - p_sa) * IPS_TWR / t_p"),
+        Flow("IS_TWR", "IS_CCP", "IS_TWR / t_d"),
+        Flow("IS_TWR", "RWT", "p_r * IS_TWR / t_i"),
+        Flow("IS_TWR", "D", "(1 - p_r) * IS_TWR / t_i"),
+        Flow("IPS_CCP", "IAS_CCP", "p_a * IPS_CCP / t_p"),
+        Flow("IPS_CCP", "IS_CCP", "(1 - p_a) * IPS_CCP / t_p"),
+        Flow("IAS_CCP", "RWT", "IAS_CCP / t_i"),
+        Flow("IS_CCP", "RWT", "p_r * IS_CCP / t_i"),
+        Flow("IS_CCP", "D", "(1 - p_r) * IS_CCP / t_i"),
+    ],
+)
+
+
+def headline_outputs(history):
+    # IS-Max, IS-AUC and final D of (..., days, vars) histories, same definitions as add_derived_columns
+    IS_total = history[..., history_index["IS"]] + history[..., history_index["IS_TWR"]] + history[..., history_index["IS_CCP"]]
+    return np.stack([IS_total.max(axis=-1), IS_total.sum(axis=-1), history[..., -1, history_index["D"]]], axis=-1)
+
+
+class QuarantineTwoEngine(HistoryRecorder):
+    def __init__(self, record_keys=None, stride=1, dtype=np.float64):
+        super().__init__(history_keys, record_keys, stride, dtype)
+
+    @timed("QuarantineTwoEngine.run")
+    def run(self, S, P):
+        A = dict()  # AUXILIARY VARIABLES
+        P["N"] = 0
+        for name, init_value in S.items():
+            # Total population is the sum of each initial non-zero stock that comes from the UI
+            P["N"] += init_value
+
+        for name in non_ui_stocks:
+            # We assume stocks outside UI begin at 0
+            S[name] = 0
+
+        self.allocate_history(P["NumDays"])
+        for step in range(1, P["NumDays"]+1):
+            # Compute Auxiliaries
+            A = self.compute_auxiliaries(A, S, P)
+            # Record History of the Selected Stocks and Auxiliary Variables
+            if (step - 1) % self.stride == 0:
+                self.record_history(S, A, (step - 1) // self.stride)
+            # Update Stocks
+            S.update(self.update_stocks(S, A, P))
+
+            # TODO: do we have to post process stock to see if there is any negative?
+
+    @timed("QuarantineTwoEngine.update_stocks")
+    def update_stocks(self, S: dict, A: dict, P: dict):
+        # TODO: consider unpacking S, A and P here
+        S_NEW = defaultdict(float)
+        # Eq [1]
+        S_NEW["S"] = S["S"] + (S["S_TWR"] / P["t_d"]) - (P["x"] * S["S"]) - A["E"]
+        # Eq [2]
+        S_NEW["S_TWR"] = S["S_TWR"] + (P["x"] * S["S"])- (S["S_TWR"] / P["t_d"])
+        # Eq [3]
+        S_NEW["NI_RNT"] = S["NI_RNT"] + ((1 - P["p_sa"]) * A["E"]) + (S["IAS"] / P["t_i"]) + (P["p_r"] * S["IS"] / P["t_i"]) + (S["NI_TWR"] / P["t_d"]) - (P["x"] * S["NI_RNT"])
+        # Eq [4]
+        S_NEW["NI_TWR"] = S["NI_TWR"] + (P["x"] * S["NI_RNT"]) - (S["NI_TWR"] / P["t_d"])
+        # Eq [5]
+        S_NEW["IPS"] = S["IPS"] + (P["p_sa"] * A["E"]) - (P["x"] * S["IPS"]) - (S["IPS"] / P["t_p"])
+        # Eq [6]
+        S_NEW["IAS"] = S["IAS"] + (P["p_a"] * S["IPS"] / P["t_p"]) - (S["IAS"] / P["t_i"]) - (P["x"] * S["IAS"])
+        # Eq [7]
+        S_NEW["IS"] = S["IS"] + ((1 - P["p_a"]) * S["IPS"] / P["t_p"]) - (S["IS"] / P["t_i"]) - (P["y"] * S["IS"])
+        # Eq [8]
+        S_NEW["IA_TWR"] = S["IA_TWR"] + P["x"] * S["IAS"] + P["p_a"] * S["IPS_TWR"] / P["t_p"] - S["IA_TWR"] / P["t_d"] - S["IA_TWR"] / P["t_i"]
+        # Eq [9]
+        S_NEW["IPS_TWR"] = S["IPS_TWR"] + P["x"] * S["IPS"] - S["IPS_TWR"] / P["t_d"] - S["IPS_TWR"] / P["t_p"]
+        # Eq [10]
+        S_NEW["IS_TWR"] = S["IS_TWR"] + P["y"] * S["IS"] + (1 - P["p_sa"]) * S["IPS_TWR"] / P["t_p"] - S["IS_TWR"] / P["t_d"] - S["IS_TWR"] / P["t_i"]
+        # Eq [11]
+        S_NEW["IAS_CCP"] = S["IAS_CCP"] + S["IA_TWR"] / P["t_d"] + P["p_a"] * S["IPS_CCP"] / P["t_p"] - S["IAS_CCP"] / P["t_i"]
+        # Eq [12]
+        S_NEW["IS_CCP"] = S["IS_CCP"] + S["IS_TWR"] / P["t_d"] + (1- P["p_a"]) * S["IPS_CCP"] / P["t_p"] - S["IS_CCP"] / P["t_i"]
+        # Eq [13]
+        S_NEW["IPS_CCP"] = S["IPS_CCP"] + S["IPS_TWR"] / P["t_d"] - S["IPS_CCP"] / P["t_p"]
+        # Eq [14]
+        S_NEW["RWT"] = S["RWT"] + S["IA_TWR"] / P["t_i"] + P["p_r"] * S["IS_TWR"] / P["t_i"] + S["IAS_CCP"] / P["t_i"] + P["p_r"] * S["IS_CCP"] / P["t_i"]
+        # Eq [15]
+        S_NEW["D"] = S["D"] + (1 - P["p_r"]) * S["IS"] / P["t_i"] + (1 - P["p_r"]) * S["IS_TWR"] / P["t_i"] + (1 - P["p_r"]) * S["IS_CCP"] / P["t_i"]
+        return S_NEW
+
+    @timed("QuarantineTwoEngine.compute_auxiliaries")
+    def compute_auxiliaries(self, A, S, P):
+        # Total Infected
+        A["TI"] = sum([S[key] for key in ["IAS", "IPS", "IS"]])
+        # Exposed
+        A["E"] = S["S"] * A["TI"] * P["beta"] / P["N"]
+        return A
+
+    @timed("QuarantineTwoEngine.record_history")
+    def record_history(self, S, A, row):
+        self.history[row] = [S[key] if key in S else A[key] for key in self.record_keys]
+
+
+class QuarantineTwoVectorEngine(StockFlowEngine):
+    """QuarantineTwoEngine compiled from quarantine_two_spec, see StockFlowEngine."""
+    def __init__(self, record_keys=None, stride=1, dtype=np.float64):
+        super().__init__(quarantine_two_spec, record_keys, stride, dtype)
+
+
+class QuarantineTwoODEEngine(StockFlowODEEngine):
+    """Continuous-time QuarantineTwo integrated by scipy, see StockFlowODEEngine."""
+    def __init__(self, method="LSODA", record_keys=None, stride=1, dtype=np.float64):
+        super().__init__(quarantine_two_spec, method=method, record_keys=record_keys, stride=stride, dtype=dtype)
+
+
+class QuarantineTwoStochasticEngine(StockFlowTauLeapEngine):
+    """Random realizations of QuarantineTwo with whole numbers of people, see StockFlowTauLeapEngine."""
+    def __init__(self, realizations=1000, seed=0, percentiles=(5, 25, 50, 75, 95), workers=1, record_keys=None,
+                 stride=1, dtype=np.float64):
+        super().__init__(quarantine_two_spec, realizations, seed, percentiles, workers, derived=derived_keys,
+                         record_keys=record_keys, stride=stride, dtype=dtype)
+
+
+engine_modes = {"dict": QuarantineTwoEngine, "vector": QuarantineTwoVectorEngine,
+                "lsoda": QuarantineTwoODEEngine, "bdf": partial(QuarantineTwoODEEngine, method="BDF")}
@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
+
+import numpy as np
+
+from .metrics import timed
+from .stockflow import HistoryRecorder
+
+
+class StockFlowTauLeapEngine(HistoryRecorder):
+    """Simulates random realizations of a StockFlowModel with whole numbers of people, by tau-leaping a day at a time.
+
+    Every day, the flows out of a stock are a multinomial draw over the people in it, taken as successive binomials.
+    The probabilities are the daily fractions of the deterministic step, scaled down when they add up to more than
+    1. Flows without a source stock are Poisson draws of their rate. On average the flows are those of
+    StockFlowEngine, but an outbreak that starts from a few people can die out by chance.
+
+    Realizations are simulated together as arrays, in blocks of `block_size`. Every block has its own Generator,
+    seeded from SeedSequence(seed).spawn, so results only depend on `seed` and `block_size`. They do not depend on
+    `workers`, the number of threads the blocks are shared among (NumPy releases the GIL in its random draws and
+    array arithmetic). Only the `percentiles` over the realizations are kept, so memory does not grow with their
+    number. History is (days, percentiles, record_keys). `derived` maps more keys to expressions of the history keys,
+    which are evaluated for every realization before the percentiles are taken.
+    """
+    def __init__(self, spec, realizations=1000, seed=0, percentiles=(5, 25, 50, 75, 95), workers=1, block_size=512,
+                 derived=None, record_keys=None, stride=1, dtype=np.float64):
+        self.spec = spec
+        self.realizations = int(realizations)
+        self.seed = seed
+        self.percentiles = list(percentiles)
+        self.workers = workers
+        self.block_size = block_size
+        self.derived = dict(derived or {})
+        self.derived_code = {key: compile(expression, "<derived {}>".format(key), "eval")
+                             for key, expression in self.derived.items()}
+        super().__init__(spec.history_keys + list(self.derived), record_keys, stride, dtype)
+
+        stock_index = {stock: i for i, stock in enumerate(spec.stocks)}
+        self.flow_ends = [(stock_index.get(flow.source), stock_index.get(flow.target)) for flow in spec.flows]
+        # Flows out of each stock, drawn together from its people
+        self.outflows = [(stock_index[stock], [i for i, flow in enumerate(spec.flows) if flow.source == stock])
+                         for stock in spec.stocks if any(flow.source == stock for flow in spec.flows)]
+        self.inflows = [i for i, flow in enumerate(spec.flows) if flow.source is None]
+
+    def allocate_history(self, num_days):
+        self.days = range(0, int(num_days), self.stride)
+        self.history = np.empty((len(self.days), len(self.percentiles), len(self.record_keys)), dtype=self.dtype,
+                                order="F")
+        return self.history
+
+    def block_sizes(self):
+        return [min(self.block_size, self.realizations - start) for start in range(0, self.realizations,
+                                                                                   self.block_size)]
+
+    @timed("StockFlowTauLeapEngine.run")
+    def run(self, S, P):
+        history = self.allocate_history(P["NumDays"])
+        for row, values in enumerate(islice(self.iter_run(S, P), 0, None, self.stride)):
+            history[row] = values
+
+    def iter_run(self, S, P):
+        # Yields the (percentiles, record_keys) values of each day as soon as every realization has computed it
+        stocks = [float(round(S.get(name, 0))) if name in self.spec.input_stocks else 0.0 for name in self.spec.stocks]
+        P = dict(P, **self.spec.initial_parameters(*stocks))
+        step = self.spec.bind(P)
+        sizes = self.block_sizes()
+        seeds = np.random.SeedSequence(self.seed).spawn(len(sizes))
+        blocks = [self.iter_block([np.full(size, value) for value in stocks], step, np.random.default_rng(seed),
+                                  int(P["NumDays"])) for size, seed in zip(sizes, seeds)]
+        with ThreadPoolExecutor(self.workers) if self.workers > 1 else nullcontext() as executor:
+            map_blocks = executor.map if executor is not None else map
+            for day in range(int(P["NumDays"])):
+                values = np.concatenate(list(map_blocks(next, blocks)))
+                yield np.percentile(values, self.percentiles, axis=0)
+
+    def iter_block(self, stocks, step, rng, num_days):
+        # Yields the (realizations, record_keys) values of a block of realizations, day after day
+        size = len(stocks[0])
+        for day in range(num_days):
+            auxiliaries, flows, _ = step(*stocks)
+            flows = [np.broadcast_to(value, (size,)) for value in flows]
+            values = stocks + flows + list(auxiliaries) if self.spec.record_flows else stocks + list(auxiliaries)
+            namespace = dict(zip(self.spec.history_keys, values))
+            for key, code in self.derived_code.items():
+                namespace[key] = eval(code, {}, namespace)
+            yield np.stack([np.broadcast_to(namespace[key], (size,)) for key in self.record_keys], axis=-1)
+            stocks = self.draw_stocks(stocks, flows, rng)
+
+    def draw_stocks(self, stocks, flows, rng):
+        draws = [None] * len(flows)
+        for source, indices in self.outflows:
+            people = stocks[source]
+            remaining = people.astype(np.int64)
+            # Daily fractions of the people leaving by each flow, scaled down when more than all of them would leave
+            fractions = [np.maximum(np.divide(flows[i], people, out=np.zeros(len(people)), where=people > 0), 0)
+                         for i in indices]
+            scale = 1 / np.maximum(sum(fractions), 1)
+            left = np.ones(len(people))
+            for i, fraction in zip(indices, fractions):
+                probability = fraction * scale
+                # Binomial of the people still there, with the probability of this flow among those left
+                draws[i] = rng.binomial(remaining, np.minimum(np.divide(probability, left, out=np.zeros(len(people)),
+                                                                        where=left > 0), 1))
+                remaining -= draws[i]
+                left -= probability
+        for i in self.inflows:
+            draws[i] = rng.poisson(np.maximum(flows[i], 0))
+
+        new_stocks = [stock.copy() for stock in stocks]
+        for (source, target), draw in zip(self.flow_ends, draws):
+            if source is not None:
+                new_stocks[source] -= draw
+            if target is not None:
+                new_stocks[target] += draw
+        return new_stocks
+
+    def history_as_pandas_df(self, percentile=50):
+        # The history of one of the percentiles, as a view of the buffer
+        import pandas as pd
+        history = self.history[:, self.percentiles.index(percentile), :]
+        return pd.DataFrame(history, columns=self.record_keys, index=pd.RangeIndex(self.days.start, self.days.stop,
+                                                                                   self.days.step), copy=False)
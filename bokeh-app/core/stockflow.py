@@ -0,0 +1,393 @@
+import ast
+from collections import namedtuple
+from itertools import chain, islice
+
+import numpy as np
+
+from .metrics import timed
+
+
+_constant_types = (ast.Constant, getattr(ast, "Num", ast.Constant))
+_operator_symbols = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/", ast.Pow: "**"}
+
+
+def signed_sum(terms):
+    # Source code adding up terms that each start with "+ " or "- "
+    if not terms:
+        return "0"
+    code = " ".join(terms)
+    return code[2:] if code.startswith("+ ") else "-" + code[2:]
+
+
+def expression_code(node):
+    # Source code of a parsed expression, fully parenthesized
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, _constant_types):
+        return repr(node.n if hasattr(node, "n") else node.value)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        return "({}{})".format("-" if isinstance(node.op, ast.USub) else "", expression_code(node.operand))
+    if isinstance(node, ast.BinOp) and type(node.op) in _operator_symbols:
+        return "({} {} {})".format(expression_code(node.left), _operator_symbols[type(node.op)],
+                                   expression_code(node.right))
+    raise ValueError("Unsupported expression {}".format(ast.dump(node)))
+
+
+def derivative_code(node, stock, auxiliary_derivatives):
+    # Source code of the derivative of a parsed expression with respect to `stock`, None when it is identically 0.
+    # auxiliary_derivatives maps auxiliary variables to the variables holding their non-zero derivatives.
+    if isinstance(node, ast.Name):
+        if node.id == stock:
+            return "1"
+        return auxiliary_derivatives.get(node.id, {}).get(stock)
+    if isinstance(node, _constant_types):
+        return None
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        d = derivative_code(node.operand, stock, auxiliary_derivatives)
+        return d if d is None or isinstance(node.op, ast.UAdd) else "(-{})".format(d)
+    if not isinstance(node, ast.BinOp) or type(node.op) not in _operator_symbols:
+        raise ValueError("Unsupported expression {}".format(ast.dump(node)))
+
+    left, right = expression_code(node.left), expression_code(node.right)
+    d_left = derivative_code(node.left, stock, auxiliary_derivatives)
+    d_right = derivative_code(node.right, stock, auxiliary_derivatives)
+    if d_left is None and d_right is None:
+        return None
+    if isinstance(node.op, (ast.Add, ast.Sub)):
+        symbol = _operator_symbols[type(node.op)]
+        if d_right is None:
+            return d_left
+        if d_left is None:
+            return d_right if symbol == "+" else "(-{})".format(d_right)
+        return "({} {} {})".format(d_left, symbol, d_right)
+    if isinstance(node.op, ast.Mult):
+        terms = [factor if d == "1" else "{} * {}".format(d, factor)
+                 for d, factor in ((d_left, right), (d_right, left)) if d is not None]
+        return "({})".format(" + ".join(terms))
+    if isinstance(node.op, ast.Div):
+        if d_right is None:
+            return "({} / {})".format(d_left, right)
+        quotient = "{} * {} / ({} * {})".format(left, d_right, right, right)
+        return "(-{})".format(quotient) if d_left is None else "({} / {} - {})".format(d_left, right, quotient)
+    # Only powers with an exponent that does not depend on the stock
+    if d_right is not None:
+        raise ValueError("Unsupported power with a stock dependent exponent {}".format(ast.dump(node)))
+    return "({} * {} ** ({} - 1) * {})".format(right, left, right, d_left)
+
+
+# A flow moves `rate` units per day from the `source` stock to the `target` stock, None stands for outside the model
+Flow = namedtuple("Flow", ["source", "target", "rate", "name"], defaults=[None])
+
+
+class StockFlowModel:
+    """Declarative description of a stock-and-flow model.
+
+    `stocks` lists the stock names, the ones in `input_stocks` get their initial value from the scenario and the others
+    begin at 0. `parameters` lists the names of the scenario parameters. `derived_parameters`
+    and `auxiliaries` map names to expressions, derived parameters are evaluated once on the initial stocks and
+    auxiliaries every day before the flows. The description is compiled into Python source (`code`) for a specialized
+    step function over the stocks, with every parameter lookup resolved once by `bind(P)`. `bind_rates(P)` gives the
+    continuous-time rates of change and their Jacobian, whose non-zero entries are at `jacobian_rows/columns`.
+    """
+    def __init__(self, name, stocks, flows, auxiliaries, input_stocks, parameters, derived_parameters=None,
+                 record_flows=False):
+        self.name = name
+        self.stocks = list(stocks)
+        self.flows = list(flows)
+        self.auxiliaries = list(auxiliaries)
+        self.input_stocks = list(input_stocks)
+        self.parameters = list(parameters)
+        self.derived_parameters = dict(derived_parameters or {})
+        self.record_flows = record_flows
+
+        self.flow_keys = [flow.name or "{}->{}".format(flow.source, flow.target) for flow in self.flows]
+        self.auxiliary_keys = [key for key, _ in self.auxiliaries]
+        self.history_keys = self.stocks + (self.flow_keys if record_flows else []) + self.auxiliary_keys
+        self.code = self.generate_code()
+        namespace = dict()
+        exec(compile(self.code, "<stockflow {}>".format(name), "exec"), namespace)
+        self.bind, self.bind_rates = namespace["bind"], namespace["bind_rates"]
+        self.initial_parameters = namespace["initial_parameters"]
+
+    def generate_code(self):
+        parameters = self.parameters + list(self.derived_parameters)
+        known = set(self.stocks) | set(parameters)
+        for key in self.stocks:
+            if not key.isidentifier():
+                raise ValueError("Stock name {!r} of {} is not an identifier".format(key, self.name))
+        for key, expression in self.derived_parameters.items():
+            self.check_expression(expression, set(self.stocks))
+
+        # Auxiliaries and flows get local variables, auxiliary names that are identifiers can be used in expressions
+        auxiliary_variables = []
+        for i, (key, expression) in enumerate(self.auxiliaries):
+            self.check_expression(expression, known)
+            variable = key if key.isidentifier() else "_a{}".format(i)
+            if variable in known:
+                raise ValueError("Auxiliary {!r} of {} shadows a stock or parameter".format(key, self.name))
+            known.add(variable)
+            auxiliary_variables.append((variable, expression))
+        flow_variables = []
+        for i, flow in enumerate(self.flows):
+            for stock in (flow.source, flow.target):
+                if stock is not None and stock not in self.stocks:
+                    raise ValueError("Flow {!r} of {} connects unknown stock {!r}".format(self.flow_keys[i], self.name, stock))
+            self.check_expression(flow.rate, known)
+            flow_variables.append(("_f{}".format(i), flow.rate))
+
+        used = set()
+        for _, expression in auxiliary_variables + flow_variables:
+            used |= self.expression_names(expression)
+        stock_arguments = ", ".join(self.stocks)
+
+        lines = ["def initial_parameters({}):".format(stock_arguments),
+                 "    return {{{}}}".format(", ".join("{!r}: {}".format(key, expression) for key, expression
+                                                      in self.derived_parameters.items())),
+                 "",
+                 "",
+                 "def bind(P):"]
+        lines += ["    {} = P[{!r}]".format(key, key) for key in parameters if key in used]
+        lines += ["", "    def step({}):".format(stock_arguments)]
+        lines += ["        {} = {}".format(variable, expression) for variable, expression in auxiliary_variables]
+        lines += ["        {} = {}".format(variable, expression) for variable, expression in flow_variables]
+        new_stocks = []
+        for stock in self.stocks:
+            terms = [stock]
+            for (variable, _), flow in zip(flow_variables, self.flows):
+                if flow.target == stock:
+                    terms.append("+ " + variable)
+                if flow.source == stock:
+                    terms.append("- " + variable)
+            new_stocks.append(" ".join(terms))
+        lines += ["        return {}, {}, {}".format(self.tuple_code(variable for variable, _ in auxiliary_variables),
+                                                      self.tuple_code(variable for variable, _ in flow_variables),
+                                                      self.tuple_code(new_stocks)),
+                  "",
+                  "    return step"]
+
+        # Continuous-time rates of change of the stocks and their analytic Jacobian, for the ODE solvers
+        auxiliary_derivatives, auxiliary_derivative_lines = dict(), []
+        for i, (variable, expression) in enumerate(auxiliary_variables):
+            auxiliary_derivatives[variable] = dict()
+            for j, stock in enumerate(self.stocks):
+                code = derivative_code(ast.parse(expression, mode="eval").body, stock, auxiliary_derivatives)
+                if code is not None:
+                    auxiliary_derivatives[variable][stock] = "_d{}_{}".format(i, j)
+                    auxiliary_derivative_lines.append("        _d{}_{} = {}".format(i, j, code))
+        rates, self.jacobian_rows, self.jacobian_columns, jacobian_entries = [], [], [], []
+        for i, stock in enumerate(self.stocks):
+            terms = []
+            for (variable, _), flow in zip(flow_variables, self.flows):
+                if flow.target == stock:
+                    terms.append("+ " + variable)
+                if flow.source == stock:
+                    terms.append("- " + variable)
+            rates.append(signed_sum(terms))
+            for j, wrt in enumerate(self.stocks):
+                terms = []
+                for flow in self.flows:
+                    code = derivative_code(ast.parse(flow.rate, mode="eval").body, wrt, auxiliary_derivatives)
+                    if code is not None and flow.target == stock:
+                        terms.append("+ " + code)
+                    if code is not None and flow.source == stock:
+                        terms.append("- " + code)
+                if terms:
+                    self.jacobian_rows.append(i)
+                    self.jacobian_columns.append(j)
+                    jacobian_entries.append(signed_sum(terms))
+        lines += ["", "", "def bind_rates(P):"]
+        lines += ["    {} = P[{!r}]".format(key, key) for key in parameters if key in used]
+        lines += ["", "    def rates({}):".format(stock_arguments)]
+        lines += ["        {} = {}".format(variable, expression) for variable, expression in auxiliary_variables]
+        lines += ["        {} = {}".format(variable, expression) for variable, expression in flow_variables]
+        lines += ["        return {}".format(self.tuple_code(rates)),
+                  "",
+                  "    def jacobian({}):".format(stock_arguments)]
+        lines += ["        {} = {}".format(variable, expression) for variable, expression in auxiliary_variables]
+        lines += auxiliary_derivative_lines
+        lines += ["        return {}".format(self.tuple_code(jacobian_entries)),
+                  "",
+                  "    return rates, jacobian",
+                  ""]
+        return "\n".join(lines)
+
+    @staticmethod
+    def tuple_code(items):
+        return "({})".format("".join(item + ", " for item in items).rstrip(" "))
+
+    @staticmethod
+    def expression_names(expression):
+        return {node.id for node in ast.walk(ast.parse(expression, mode="eval")) if isinstance(node, ast.Name)}
+
+    def check_expression(self, expression, known):
+        unknown = self.expression_names(expression) - known
+        if unknown:
+            raise ValueError("Unknown names {} in expression {!r} of {}".format(sorted(unknown), expression, self.name))
+
+
+class HistoryRecorder:
+    """History of the last run of an engine, in one buffer allocated at the start of every run.
+
+    ``record_keys`` picks which of the engine's history keys are recorded, in that order, and every ``stride``-th day
+    is recorded from day 0 on. The buffer is column-major so that every variable is contiguous, the DataFrame of
+    ``history_as_pandas_df`` is a view of it. Runs allocate a new buffer instead of overwriting the last one, so frames
+    of earlier runs that are kept in a cache stay valid.
+    """
+    def __init__(self, history_keys, record_keys=None, stride=1, dtype=np.float64):
+        self.record_keys = list(history_keys if record_keys is None else record_keys)
+        unknown = [key for key in self.record_keys if key not in history_keys]
+        if unknown:
+            raise ValueError("Unknown history keys: {}".format(", ".join(unknown)))
+        if int(stride) < 1:
+            raise ValueError("stride must be at least 1, not {}".format(stride))
+        self.record_columns = np.array([list(history_keys).index(key) for key in self.record_keys], dtype=int)
+        self.stride = int(stride)
+        self.dtype = np.dtype(dtype)
+        self.allocate_history(0)
+
+    def allocate_history(self, num_days):
+        self.days = range(0, int(num_days), self.stride)
+        self.history = np.empty((len(self.days), len(self.record_keys)), dtype=self.dtype, order="F")
+        return self.history
+
+    def select_history(self, history):
+        # Recorded days and keys of a full (..., days, history_keys) history
+        return np.asarray(history[..., ::self.stride, :][..., self.record_columns], dtype=self.dtype)
+
+    @timed("HistoryRecorder.history_as_pandas_df")
+    def history_as_pandas_df(self):
+        # pandas is only needed by the dashboard, batch workers never import it
+        import pandas as pd
+        return pd.DataFrame(self.history, columns=self.record_keys, index=pd.RangeIndex(self.days.start,
+                                                                                        self.days.stop,
+                                                                                        self.days.step), copy=False)
+
+
+class StockFlowEngine(HistoryRecorder):
+    """Runs a StockFlowModel with the step function compiled from it.
+
+    ``run`` and ``iter_run`` step a single scenario over Python floats, ``run_batch`` takes initial stocks and
+    parameters as scalars or arrays with a leading batch dimension and returns ``(batch, days, vars)``. ``run`` and
+    ``run_batch`` keep the days and keys picked by ``record_keys`` and ``stride``, see HistoryRecorder, ``iter_run``
+    yields every day with all of ``spec.history_keys``.
+    """
+    def __init__(self, spec, record_keys=None, stride=1, dtype=np.float64):
+        self.spec = spec
+        super().__init__(spec.history_keys, record_keys, stride, dtype)
+
+    def initial_stocks(self, S):
+        # Stocks outside the inputs begin at 0
+        return [S.get(name, 0) if name in self.spec.input_stocks else 0 for name in self.spec.stocks]
+
+    @timed("StockFlowEngine.run")
+    def run(self, S, P):
+        history = self.allocate_history(P["NumDays"])
+        for row, values in enumerate(islice(self.iter_run(S, P), 0, None, self.stride)):
+            history[row] = values[self.record_columns]
+
+    def iter_run(self, S, P):
+        # Yields the history_keys values of each day as soon as the day is computed
+        stocks = tuple(float(value) for value in self.initial_stocks(S))
+        P = dict(P, **self.spec.initial_parameters(*stocks))
+        step = self.spec.bind(P)
+        record_flows = self.spec.record_flows
+        for day in range(P["NumDays"]):
+            auxiliaries, flows, new_stocks = step(*stocks)
+            yield np.array(stocks + flows + auxiliaries if record_flows else stocks + auxiliaries)
+            stocks = new_stocks
+
+    @timed("StockFlowEngine.run_batch")
+    def run_batch(self, S, P):
+        num_days = int(P["NumDays"])
+        P = {name: np.asarray(value, dtype=float) for name, value in P.items() if name != "NumDays"}
+        initials = [np.asarray(value, dtype=float) for value in self.initial_stocks(S)]
+        batch_shape = np.broadcast(*initials).shape
+        parameter_shape = np.broadcast(*P.values()).shape if P else ()
+        batch_size = max(batch_shape[0] if batch_shape else 1, parameter_shape[0] if parameter_shape else 1)
+
+        stocks = tuple(np.broadcast_to(value, (batch_size,)).copy() for value in initials)
+        P.update(self.spec.initial_parameters(*stocks))
+        step = self.spec.bind(P)
+        record_flows = self.spec.record_flows
+
+        history = np.empty((batch_size, len(range(0, num_days, self.stride)), len(self.record_keys)), dtype=self.dtype)
+        for day in range(num_days):
+            auxiliaries, flows, new_stocks = step(*stocks)
+            if day % self.stride == 0:
+                values = stocks + flows + auxiliaries if record_flows else stocks + auxiliaries
+                for i, column in enumerate(self.record_columns):
+                    history[:, day // self.stride, i] = values[column]
+            stocks = new_stocks
+        return history
+
+
+class StockFlowODEEngine(StockFlowEngine):
+    """Integrates the continuous-time version of a StockFlowModel with scipy.integrate.solve_ivp.
+
+    The right-hand side is evaluated for many states at once and the analytic Jacobian is passed to the implicit
+    methods, sparse for "BDF" and "Radau" and dense for "LSODA". The dense output of the solution (`solution.sol`) is
+    sampled at every day, auxiliaries and flows are the instantaneous values on those days.
+    """
+    def __init__(self, spec, method="LSODA", rtol=1e-6, atol=1e-6, record_keys=None, stride=1, dtype=np.float64):
+        super().__init__(spec, record_keys, stride, dtype)
+        self.method = method
+        self.rtol = rtol
+        self.atol = atol
+        self.solution = None
+
+    @timed("StockFlowODEEngine.solve")
+    def solve(self, S, P):
+        from scipy.integrate import solve_ivp
+        from scipy.sparse import csc_matrix
+
+        stocks = np.array(self.initial_stocks(S), dtype=float)
+        P = dict(P, **self.spec.initial_parameters(*stocks))
+        rates, jacobian = self.spec.bind_rates(P)
+        rows, columns = np.array(self.spec.jacobian_rows, dtype=int), np.array(self.spec.jacobian_columns, dtype=int)
+        shape = (len(stocks), len(stocks))
+
+        def fun(t, y):
+            return np.array(np.broadcast_arrays(*rates(*y)), dtype=float)
+
+        def jac(t, y):
+            values = np.array(jacobian(*y), dtype=float)
+            if self.method != "LSODA":
+                return csc_matrix((values, (rows, columns)), shape=shape)
+            matrix = np.zeros(shape)
+            matrix[rows, columns] = values
+            return matrix
+
+        last_day = max(int(P["NumDays"]) - 1, 0)
+        self.solution = solve_ivp(fun, (0, last_day), stocks, method=self.method, dense_output=True, vectorized=True,
+                                  jac=jac, rtol=self.rtol, atol=self.atol)
+        if not self.solution.success:
+            raise RuntimeError("{} integration of {} failed: {}".format(self.method, self.spec.name,
+                                                                        self.solution.message))
+        days = np.arange(int(P["NumDays"]), dtype=float)
+        stock_values = self.solution.sol(days) if last_day > 0 else np.repeat(stocks[:, np.newaxis], len(days), axis=1)
+
+        auxiliaries, flows, _ = self.spec.bind(P)(*stock_values)
+        values = tuple(stock_values) + (flows + auxiliaries if self.spec.record_flows else auxiliaries)
+        history = np.empty((len(days), len(self.spec.history_keys)))
+        for i, value in enumerate(values):
+            history[:, i] = value
+        return history
+
+    def run(self, S, P):
+        self.allocate_history(P["NumDays"])[:] = self.select_history(self.solve(S, P))
+
+    def iter_run(self, S, P):
+        # The whole solution is computed before the first day is yielded
+        yield from self.solve(S, P)
+
+    def run_batch(self, S, P):
+        # Every scenario takes its own adaptive steps
+        inputs = [np.asarray(value, dtype=float) for value in chain(S.values(), P.values())]
+        batch_size = max([value.shape[0] for value in inputs if value.ndim] or [1])
+        histories = []
+        for b in range(batch_size):
+            S_b = {name: np.broadcast_to(value, (batch_size,))[b] for name, value in S.items()}
+            P_b = {name: np.broadcast_to(value, (batch_size,))[b] for name, value in P.items()}
+            P_b["NumDays"] = int(P["NumDays"])
+            histories.append(self.select_history(self.solve(S_b, P_b)))
+        return np.stack(histories)
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from .metrics import increment
+
+
+def source_version(*directories):
+    # sha256 of the Python sources in directories, changes with any edit of the code that computes the results
+    digest = hashlib.sha256()
+    for directory in directories:
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".py"):
+                with open(os.path.join(directory, name), "rb") as f:
+                    digest.update(name.encode() + b"\0" + f.read() + b"\0")
+    return digest.hexdigest()
+
+
+class ResultStore:
+    """Simulation histories shared by every session and server process, as .npy files in `directory`.
+
+    Files are named by the sha256 of the canonicalized inputs and `version`, and read back memory-mapped, so processes
+    share the pages instead of holding copies. The version stands for the code that computed them, see source_version,
+    so results of other versions of the engines are never read back from the shared directory. Files are written under
+    a temporary name and renamed into place. Every read or write of a file refreshes its modification time, and the
+    least recently used files are removed past `max_bytes`.
+    """
+    def __init__(self, directory=None, max_bytes=512 * 1024 ** 2, version=""):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "2019-nCov-results")
+        self.max_bytes = max_bytes
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, model_name, population_initials_dict, spread_factors_dict):
+        # Numbers are compared as floats, so 10 from a TextInput and 10.0 from a slider give the same key
+        canonical = json.dumps([self.version, model_name,
+                                sorted((name, float(value)) for name, value in population_initials_dict.items()),
+                                sorted((name, float(value)) for name, value in spread_factors_dict.items())])
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            history = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # Missing, evicted by another process since, or not completely written
+            self.misses += 1
+            increment("ncov_result_cache_requests_total", cache="store", result="miss")
+            return None
+        self.hits += 1
+        increment("ncov_result_cache_requests_total", cache="store", result="hit")
+        return history
+
+    def put(self, key, history):
+        path = self.path(key)
+        try:
+            # Already written by another session or process, it is used again
+            os.utime(path)
+            return
+        except FileNotFoundError:
+            pass
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as f:
+                np.save(f, np.asarray(history, dtype=float))
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        # Readers that already mapped an evicted file keep their pages until they drop the array
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        nbytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if nbytes <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            nbytes -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy"):
+                os.unlink(entry.path)
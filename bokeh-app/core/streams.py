@@ -0,0 +1,75 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import SyncManager
+from queue import Empty
+from time import perf_counter
+
+import numpy as np
+
+
+def put_days(engine_factory, S, P, chunks, stop, time_budget=0.02):
+    # engine_factory().iter_run(S, P) in a worker process, its days are put on `chunks` every time_budget seconds until
+    # `stop` is set. The engine is built here, the functions compiled from a spec cannot be pickled.
+    try:
+        rows = []
+        deadline = perf_counter() + time_budget
+        for values in engine_factory().iter_run(S, P):
+            rows.append(values)
+            if perf_counter() > deadline:
+                if stop.is_set():
+                    return
+                chunks.put(np.stack(rows))
+                rows = []
+                deadline = perf_counter() + time_budget
+        if rows:
+            chunks.put(np.stack(rows))
+    finally:
+        chunks.put(None)
+
+
+def queued_days(future, chunks, stop, poll_seconds=1.0):
+    # Days put on `chunks` by the run of `future`, waiting for them does not hold the GIL
+    try:
+        while True:
+            try:
+                rows = chunks.get(timeout=poll_seconds)
+            except Empty:
+                # The worker of a broken pool never puts the end of its days
+                if future.done():
+                    future.result()
+                    return
+                continue
+            if rows is None:
+                # Raises the error the run stopped with
+                future.result()
+                return
+            yield from rows
+    finally:
+        # Stops the run at its next chunk, or before it starts when it is still queued
+        stop.set()
+        future.cancel()
+
+
+class StreamPool:
+    """Engine runs on a pool of processes, their days streamed back as they are computed.
+
+    The engines hold the GIL of a worker instead of the one of the server, so its event loop keeps answering every
+    session while runs compute. `iter_run` returns an iterator over the days of a run, closing it stops the run.
+    """
+
+    def __init__(self, max_workers):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        # Serves the queues the days are sent back on
+        self.manager = SyncManager()
+
+    def start(self):
+        # Forks the manager and every worker, before the server starts other threads
+        self.manager.start()
+        self.executor.submit(int).result()
+
+    def iter_run(self, engine_factory, S, P):
+        chunks, stop = self.manager.Queue(), self.manager.Event()
+        return queued_days(self.executor.submit(put_days, engine_factory, S, P, chunks, stop), chunks, stop)
+
+    def shutdown(self):
+        self.executor.shutdown()
+        self.manager.shutdown()
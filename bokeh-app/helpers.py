@@ -1,5 +1,28 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
 from bokeh.io import curdoc
 
+from .core.store import ResultStore, source_version
+from .core.streams import StreamPool
+
+# Model runs of every session in this server process are computed by these processes, so they do not hold the GIL
+# while the Tornado event loop answers sessions. Runs past max_workers wait for one of them to finish.
+engine_pool = StreamPool(max_workers=4)
+# Threads waiting for the days of the runs on engine_pool, and pushing them to their documents
+simulation_pool = ThreadPoolExecutor(max_workers=4)
+# Sensitivity samples of every session are evaluated by these processes, analyses queue their chunks on them
+sample_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+# The processes of engine_pool and sample_pool are forked once by app_hooks.on_server_loaded, before the server
+# starts other threads
+# Sensitivity analyses wait here for their samples, analyses past max_workers wait for one of them to finish
+analysis_pool = ThreadPoolExecutor(max_workers=2)
+APP_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# Results shared by every session and every --num-procs process of the server, and by later servers running the same
+# engines and models
+result_store = ResultStore(version=source_version(os.path.join(APP_DIRECTORY, "core"),
+                                                  os.path.join(APP_DIRECTORY, "models")))
+
 
 def refresh_layout(l):
     curdoc().clear()
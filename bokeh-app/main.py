@@ -1,14 +1,47 @@
+import logging
+from concurrent.futures import CancelledError
+import os
+import tempfile
+from functools import partial
+from itertools import chain
+from time import perf_counter, strftime
+
 from bokeh.io import curdoc
 from bokeh.layouts import layout, column
-from bokeh.models import Select, Div, Button
+from bokeh.models import Select, Div, Button, Tabs, Panel, RadioButtonGroup, Toggle, Slider, TextInput
 from bokeh.plotting import figure
 
-from .helpers import refresh_layout
+from .core import metrics
+from .core.metrics import timed, observe, SamplingProfiler
+from .helpers import refresh_layout, simulation_pool, engine_pool, result_store, sample_pool, analysis_pool
+from .models.cache import ResultCache
 from .models.quarantine_two import QuarantineTwo
+from .models.quarantine_two_regions import QuarantineTwoRegions
+from .models.quarantine_two_stochastic import QuarantineTwoStochastic
+from .models.sensitivity import run_sensitivity
+from .models.calibration import Calibration, load_observations
+
+log = logging.getLogger(__name__)
 
-MODELS = {"Quarantine #2": QuarantineTwo}
+MODELS = {"Quarantine #2": QuarantineTwo, "Quarantine #2 (regions)": QuarantineTwoRegions,
+          "Quarantine #2 (stochastic)": QuarantineTwoStochastic}
 model_menu = list(MODELS.keys())
-model = MODELS[model_menu[0]]()
+# Daily steps are the original discrete model, the ODE solvers integrate its continuous-time version
+SOLVERS = {"Daily steps": "vector", "ODE (LSODA)": "lsoda", "ODE (BDF)": "bdf"}
+solver_menu = list(SOLVERS.keys())
+# main.py runs once per browser session, so the cache and model below are per session
+result_cache = ResultCache()
+model = MODELS[model_menu[0]](cache=result_cache, store=result_store)
+# Incremented by every new run, so that runs still computing for older inputs stop and drop their results
+run_id = 0
+live_run_timeout = None
+LIVE_RUN_DEBOUNCE_MS = 300
+# Start of the latest run, and the profiler sampling it when "Profile Next Run" is on
+run_started = None
+profiler = None
+# Incremented by every fit and model change, fits of older ones stop and drop their results
+calibration_id = 0
+calibration_future = None
 
 
 def get_dynamic_control_panel():
@@ -22,44 +55,258 @@ def set_dynamic_control_panel(new_dynamic_control_panel):
 
 def update_control_widget_by_model(attr, old_model, new_model):
     # Refresh control menu based on new value of dropdown selection
-    model = MODELS[new_model]()
-    set_dynamic_control_panel(model.dynamic_control_panel())
+    global model, run_id, calibration_id
+    run_id += 1
+    calibration_id += 1
+    model = MODELS[new_model](engine_mode=SOLVERS[solver_select.value], cache=result_cache, store=result_store)
+    set_dynamic_control_panel(watch_control_panel(model.dynamic_control_panel()))
+    analysis_tabs.tabs[1].child, analysis_tabs.tabs[2].child = analysis_panels()
+
+
+def update_solver(attr, old_solver, new_solver):
+    global run_id
+    run_id += 1
+    model.set_engine_mode(SOLVERS[new_solver])
+    schedule_live_run(attr, old_solver, new_solver)
 
 
 def set_plot_panel(new_plot_panel):
-    l.children[1].children[1].children[0] = new_plot_panel
+    # The plot panel is built once per model, afterwards only its data source changes
+    if plot_column.children[0] is not new_plot_panel:
+        plot_column.children[0] = new_plot_panel
 
 
+def get_y_scale():
+    return "log" if scale_select.active == 1 else "linear"
+
+
+@timed("update_figures_scale")
 def update_figures_scale(attr, old_active, new_active, l):
     new_y_scale = "log" if new_active == 1 else "linear"
-    # Run Model and store data to plot
-    model = MODELS[model_select.value]()
-    model.run_with_the_input_from_control_panel(get_dynamic_control_panel())
-    # Update plot panel
-    set_plot_panel(model.plot_panel(y_scale=new_y_scale))
-    refresh_layout(l)
+    # Switch the scale of the existing figures, no need to rerun the model
+    model.set_y_scale(new_y_scale)
+
+
+def stream_run(doc, run_model, this_run_id, days, run_profiler):
+    # Runs on the simulation pool, days are applied to the document from next tick callbacks
+    if run_profiler is not None:
+        run_profiler.watch_current_thread()
+    try:
+        finished = False
+        while not finished and this_run_id == run_id:
+            rows, finished = run_model.take_days(days)
+            doc.add_next_tick_callback(partial(apply_days, run_model, this_run_id, rows, finished))
+    finally:
+        days.close()
+        if run_profiler is not None:
+            run_profiler.unwatch_current_thread()
+
+
+def check_stream_run(doc, this_run_id, future):
+    # Done callback of stream_run, on the thread that ran it
+    if future.cancelled() or future.exception() is None:
+        return
+    log.error("Run %s failed", this_run_id, exc_info=future.exception())
+    doc.add_next_tick_callback(partial(fail_run, this_run_id, "Run failed: {}".format(future.exception())))
+
 
+def apply_days(run_model, this_run_id, rows, finished):
+    # Drop days of runs superseded since they were computed
+    if this_run_id == run_id:
+        run_model.push_days(rows, finished)
+        if finished:
+            finish_run()
 
+
+def finish_run():
+    # The whole run has been plotted
+    global profiler
+    observe("ncov_run_seconds", perf_counter() - run_started, engine=model.engine_mode)
+    if profiler is not None:
+        profiler.stop()
+        path = os.path.join(tempfile.gettempdir(), "ncov-profile-{}.folded".format(strftime("%Y%m%d-%H%M%S")))
+        profile_status.text = "Profile saved to {}".format(profiler.dump(path))
+        profile_toggle.active = False
+        profiler = None
+
+
+def fail_run(this_run_id, text):
+    # The plots keep the days streamed before the error, the next run starts over
+    global profiler
+    if this_run_id != run_id:
+        return
+    run_status.text = text
+    if profiler is not None:
+        profiler.stop()
+        profile_status.text = ""
+        profile_toggle.active = False
+        profiler = None
+
+
+@timed("run_and_plot")
 def run_and_plot(event):
-    # Run Model and store data to plot
-    model = MODELS[model_select.value]()
-    model.run_with_the_input_from_control_panel(get_dynamic_control_panel())
+    global run_id, run_started, profiler
+    # A new run cancels any run that is still computing
+    run_id += 1
+    run_started = perf_counter()
+    if profile_toggle.active and profiler is None:
+        profiler = SamplingProfiler()
+        profiler.watch_current_thread()
+        profiler.start()
+    run_status.text = ""
+    # Start the model, unchanged inputs are answered from the result cache and not streamed. Profiled runs are computed
+    # by the thread the profiler samples instead of the engine pool.
+    days = model.start_streaming_run(get_dynamic_control_panel(), engine_pool if profiler is None else None)
     # Update plot panel
-    set_plot_panel(model.plot_panel())
-    refresh_layout(l)
-    pass
+    set_plot_panel(model.plot_panel(y_scale=get_y_scale()))
+    # Compute the days off the event loop and push them to the plots as they arrive
+    if days is not None:
+        future = simulation_pool.submit(stream_run, curdoc(), model, run_id, days, profiler)
+        future.add_done_callback(partial(check_stream_run, curdoc(), run_id))
+    else:
+        finish_run()
+
+
+def live_run():
+    global live_run_timeout
+    live_run_timeout = None
+    run_and_plot(None)
+
+
+def schedule_live_run(attr, old, new):
+    # Debounce the changes of a dragged slider into a single run
+    global live_run_timeout
+    if not live_toggle.active:
+        return
+    if live_run_timeout is not None:
+        curdoc().remove_timeout_callback(live_run_timeout)
+    live_run_timeout = curdoc().add_timeout_callback(live_run, LIVE_RUN_DEBOUNCE_MS)
+
+
+def watch_control_panel(control_panel):
+    for widget in chain(control_panel.select({"type": Slider}), control_panel.select({"type": TextInput})):
+        widget.on_change("value", schedule_live_run)
+    return control_panel
+
+
+def set_sensitivity_status(text):
+    model.sensitivity_status.text = text
+
+
+def finish_sensitivity(result, text):
+    model.show_sensitivity(result)
+    model.sensitivity_status.text = text
+    model.sensitivity_button.disabled = False
+
+
+def run_sensitivity_analysis(event):
+    # The analysis waits on the server-wide pools, widgets are only touched from next tick callbacks
+    doc = curdoc()
+    method, n, seed = model.sensitivity_inputs()
+    S, P = model.parse_control_panel_values_to_engine_init(get_dynamic_control_panel())
+    model.sensitivity_button.disabled = True
+    set_sensitivity_status("Queued...")
+
+    def report_progress(done, total):
+        doc.add_next_tick_callback(partial(set_sensitivity_status, "Ran {}/{} samples".format(done, total)))
+
+    def analyse():
+        try:
+            result = run_sensitivity(method, n, seed, S=S, P=P, executor=sample_pool, progress=report_progress)
+        except Exception as e:
+            doc.add_next_tick_callback(partial(finish_sensitivity, None, "Failed: {}".format(e)))
+        else:
+            doc.add_next_tick_callback(partial(finish_sensitivity, result, "Done"))
+
+    analysis_pool.submit(analyse)
+
+
+def set_calibration_status(this_calibration_id, text):
+    if this_calibration_id == calibration_id:
+        model.calibration_status.text = text
+
+
+def finish_calibration(this_calibration_id, result, observed, simulated, text):
+    # Drop fits superseded since they started
+    if this_calibration_id != calibration_id:
+        return
+    model.show_calibration(result, observed, simulated)
+    model.calibration_status.text = text
+    model.calibration_button.disabled = False
+
+
+def run_calibration(event):
+    # Like the sensitivity analysis, the fit waits on the analysis pool and reports from next tick callbacks
+    global calibration_id, calibration_future
+    doc = curdoc()
+    path, starts, seed = model.calibration_inputs()
+    S, P = model.parse_control_panel_values_to_engine_init(get_dynamic_control_panel())
+    calibration_id += 1
+    this_calibration_id = calibration_id
+    # A fit of an earlier model that has not started yet never starts
+    if calibration_future is not None:
+        calibration_future.cancel()
+    model.calibration_button.disabled = True
+    set_calibration_status(this_calibration_id, "Queued...")
+
+    def report_progress(done, total):
+        # Stops a superseded fit after its current start
+        if this_calibration_id != calibration_id:
+            raise CancelledError()
+        doc.add_next_tick_callback(partial(set_calibration_status, this_calibration_id,
+                                           "Finished {}/{} starts".format(done, total)))
+
+    def fit():
+        try:
+            observed = load_observations(path)
+            calibration = Calibration(observed, S=S, P=P)
+            result = calibration.fit(starts=starts, seed=seed, progress=report_progress)
+            simulated = calibration.simulate(result["S"], result["P"])
+        except Exception as e:
+            doc.add_next_tick_callback(partial(finish_calibration, this_calibration_id, None, None, None,
+                                               "Failed: {}".format(e)))
+        else:
+            text = "Done, cost {:.4g} after {} model runs".format(result["cost"], result["evaluations"])
+            doc.add_next_tick_callback(partial(finish_calibration, this_calibration_id, result, observed, simulated,
+                                               text))
+
+    calibration_future = analysis_pool.submit(fit)
+
+
+def load_calibration(event):
+    # Fitted values replace the control panel inputs, live recompute picks them up like any other edit
+    model.load_into_control_panel(get_dynamic_control_panel(), model.calibration_result["parameters"])
+
+
+def analysis_panels():
+    # The sensitivity and calibration panels of the current model
+    sensitivity_column = model.sensitivity_panel()
+    model.sensitivity_button.on_click(run_sensitivity_analysis)
+    calibration_column = model.calibration_panel()
+    model.calibration_button.on_click(run_calibration)
+    model.calibration_load_button.on_click(load_calibration)
+    return sensitivity_column, calibration_column
 
 
 # Create plots and widgets
 heading = Div(text="""<h1>ASU 2019-nCov Demo</h1><p>The Dashboard</p>""", height=100, id="main-header")
 model_select = Select(title="Model", value=model_menu[0], options=model_menu, id="model-select")
+solver_select = Select(title="Solver", value=solver_menu[0], options=solver_menu, id="solver-select")
 run_button = Button(label="Run", button_type="success", id="run-button")
+run_status = Div(text="", id="run-status")
+scale_select = RadioButtonGroup(labels=["Linear", "Log"], active=0, id="scale-select")
+live_toggle = Toggle(label="Live Recompute", active=False, id="live-toggle")
+# Only offered when the server collects metrics, the folded stacks can be opened with flamegraph.pl or speedscope
+profile_toggle = Toggle(label="Profile Next Run", active=False, id="profile-toggle", visible=metrics.enabled)
+profile_status = Div(text="", id="profile-status", visible=metrics.enabled)
 
 # Add callbacks
 model_select.on_change("value", update_control_widget_by_model)
+solver_select.on_change("value", update_solver)
 run_button.on_click(run_and_plot)
 
-fixed_control_panel = column(children=[model_select, run_button], id="fixed-control-panel")
+fixed_control_panel = column(children=[model_select, solver_select, run_button, run_status, scale_select, live_toggle,
+                                       profile_toggle, profile_status], id="fixed-control-panel")
 
 # Arrange plots and widgets in layouts
 scenario_header = Div(text="""<h2>Scenario</h2>""", height=50, id="scenario-header", sizing_mode="stretch_width")
@@ -67,16 +314,27 @@ scenario_header = Div(text="""<h2>Scenario</h2>""", height=50, id="scenario-head
 config_header = Div(text="""<h2>Scenario Configuration</h2>""", height=50, id="config-header",
                     sizing_mode="stretch_width")
 
-dynamic_widgets = model.dynamic_control_panel()
+dynamic_widgets = watch_control_panel(model.dynamic_control_panel())
 
 control_panel = column(*(scenario_header, fixed_control_panel, config_header, dynamic_widgets),
                        sizing_mode="scale_height", width=350, background="whitesmoke", id="control-panel")
 
 plot_column = column(*(figure(title=""),), sizing_mode="scale_width", id="plot-panel")
 
+sensitivity_column, calibration_column = analysis_panels()
+
+analysis_tabs = Tabs(tabs=[Panel(child=plot_column, title="Scenario"),
+                           Panel(child=sensitivity_column, title="Sensitivity"),
+                           Panel(child=calibration_column, title="Calibration")], sizing_mode="scale_width")
+
 l = layout([
     [heading],
-    [control_panel, plot_column],
+    [control_panel, analysis_tabs],
 ], sizing_mode="stretch_both")
 
+scale_select.on_change("active", partial(update_figures_scale, l=l))
+
 curdoc().add_root(l)
+
+# Open on the default scenario, which app_hooks.on_server_loaded put in the shared result store
+run_and_plot(None)
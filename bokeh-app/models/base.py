@@ -9,4 +9,10 @@ class BaseModel(ABC):
         raise NotImplementedError
 
     def plot_panel(self):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def sensitivity_panel(self):
+        raise NotImplementedError
+
+    def calibration_panel(self):
+        raise NotImplementedError
@@ -0,0 +1,43 @@
+from collections import OrderedDict
+
+from ..core.metrics import increment
+
+
+class ResultCache:
+    """LRU cache of model results keyed on the parsed control panel inputs, capped by memory use."""
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_name, population_initials_dict, spread_factors_dict):
+        return model_name, tuple(sorted(population_initials_dict.items())), tuple(sorted(spread_factors_dict.items()))
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            increment("ncov_result_cache_requests_total", cache="session", result="miss")
+            return None
+        self.hits += 1
+        increment("ncov_result_cache_requests_total", cache="session", result="hit")
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, hist_df):
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+        nbytes = int(hist_df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        self.entries[key] = (hist_df, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted_nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
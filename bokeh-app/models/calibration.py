@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+from ..core.quarantine_two import QuarantineTwoVectorEngine, history_index
+from .sensitivity import default_scenario
+
+calibration_parameter_keys = ["beta", "p_a", "x", "y", "IAS", "IPS", "IS"]
+calibration_stock_keys = ["IAS", "IPS", "IS"]
+# Parameters are searched uniformly, or uniformly in log space for those spanning orders of magnitude
+default_calibration_bounds = {"beta": (0.01, 2.0), "p_a": (0.0, 1.0), "x": (1e-8, 0.1), "y": (1e-4, 1.0),
+                              "IAS": (1.0, 1e5), "IPS": (1.0, 1e5), "IS": (1.0, 1e5)}
+log_scale_keys = {"beta", "x", "y", "IAS", "IPS", "IS"}
+observed_keys = ["cases", "deaths"]
+
+
+def load_observations(path):
+    """Read observed cumulative cases and deaths from a CSV file.
+
+    The file has a "cases" and/or a "deaths" column and either a "day" column counted from the first simulated day or
+    a "date" column whose first date is day 0. Missing values are left out of the fit.
+    """
+    observed = pd.read_csv(path)
+    observed.columns = [column.strip().lower() for column in observed.columns]
+    if "day" in observed:
+        days = observed["day"].astype(int)
+    elif "date" in observed:
+        dates = pd.to_datetime(observed["date"])
+        days = (dates - dates.min()).dt.days
+    else:
+        raise ValueError("{} has neither a day nor a date column".format(path))
+    if not any(key in observed for key in observed_keys):
+        raise ValueError("{} has neither a cases nor a deaths column".format(path))
+    observed = observed.reindex(columns=observed_keys).astype(float)
+    observed.index = days.values
+    return observed.sort_index()
+
+
+def simulated_observations(history, t_d):
+    # Cumulative confirmed cases are the tests that came back positive, the flows from the TWR to the CCP stocks
+    tested = history[..., history_index["IA_TWR"]] + history[..., history_index["IPS_TWR"]] + \
+        history[..., history_index["IS_TWR"]]
+    cases = np.cumsum(tested / np.reshape(t_d, np.shape(t_d) + (1,)), axis=-1)
+    cases = np.concatenate([np.zeros(cases.shape[:-1] + (1,)), cases[..., :-1]], axis=-1)
+    return np.stack([cases, history[..., history_index["D"]]], axis=-1)
+
+
+class Calibration:
+    """Least-squares fit of calibration_parameter_keys to observed cumulative cases and deaths.
+
+    Residuals are the differences of log(1 + count) on every observed day. Candidate points and the finite difference
+    Jacobian are evaluated as one batch of the vectorized engine, so each iteration is a single run_batch call.
+    """
+    def __init__(self, observed, S=None, P=None, bounds=None, keys=None):
+        default_S, default_P = default_scenario()
+        self.S, self.P = dict(S or default_S), dict(P or default_P)
+        self.keys = list(keys or calibration_parameter_keys)
+        self.bounds = dict(default_calibration_bounds, **(bounds or {}))
+        self.days = observed.index.values.astype(int)
+        self.observed = np.log1p(observed.values)
+        self.mask = ~np.isnan(self.observed)
+        self.P["NumDays"] = int(self.days.max()) + 1
+        self.engine = QuarantineTwoVectorEngine()
+        self.evaluations = 0
+
+    def to_values(self, u):
+        # (..., keys) points of the unit cube to parameter values
+        values = np.empty(np.shape(u))
+        for i, key in enumerate(self.keys):
+            low, high = self.bounds[key]
+            if key in log_scale_keys:
+                values[..., i] = low * (high / low) ** u[..., i]
+            else:
+                values[..., i] = low + u[..., i] * (high - low)
+        return values
+
+    def scenario(self, values):
+        S = dict(self.S, **{key: values[..., i] for i, key in enumerate(self.keys) if key in calibration_stock_keys})
+        P = dict(self.P, **{key: values[..., i] for i, key in enumerate(self.keys) if key not in calibration_stock_keys})
+        return S, P
+
+    def residuals_batch(self, u):
+        # Residuals of every row of u, as one run_batch
+        u = np.atleast_2d(u)
+        S, P = self.scenario(self.to_values(u))
+        history = self.engine.run_batch(S, P)
+        simulated = simulated_observations(history, np.broadcast_to(P["t_d"], (len(u),)))[:, self.days]
+        self.evaluations += len(u)
+        return (np.log1p(np.maximum(simulated, 0)) - self.observed)[:, self.mask]
+
+    def residuals(self, u):
+        return self.residuals_batch(u)[0]
+
+    def jacobian(self, u, step=1e-6):
+        # Forward differences, with the steps taken away from the upper bound of the unit cube
+        steps = np.where(u + step <= 1, step, -step)
+        points = np.repeat(u[np.newaxis], len(u) + 1, axis=0)
+        points[np.arange(1, len(u) + 1), np.arange(len(u))] += steps
+        r = self.residuals_batch(points)
+        return ((r[1:] - r[0]) / steps[:, np.newaxis]).T
+
+    def fit(self, starts=8, candidates=256, seed=0, progress=None):
+        """Run least_squares from the `starts` best of `candidates` random points and return the best fit.
+
+        `progress(done, total)` is called after every start. The result has the fitted "parameters", the scenario
+        ("S", "P") to load into the control panel, the final "cost" and "success" of the best start.
+        """
+        from scipy.optimize import least_squares
+
+        rng = np.random.default_rng(seed)
+        candidate_points = rng.random((candidates, len(self.keys)))
+        candidate_costs = np.sum(self.residuals_batch(candidate_points) ** 2, axis=1)
+        best = None
+        for done, u0 in enumerate(candidate_points[np.argsort(candidate_costs)[:starts]], start=1):
+            result = least_squares(self.residuals, u0, jac=self.jacobian, bounds=(0, 1), method="trf")
+            if best is None or result.cost < best.cost:
+                best = result
+            if progress:
+                progress(done, starts)
+
+        values = self.to_values(best.x)
+        S, P = self.scenario(values)
+        return {"parameters": dict(zip(self.keys, values)), "S": S, "P": P, "cost": best.cost,
+                "success": best.success, "evaluations": self.evaluations}
+
+    def simulate(self, S, P):
+        # Simulated cumulative cases and deaths of a scenario on every day up to the last observed one
+        history = self.engine.run_batch(S, dict(P, NumDays=self.P["NumDays"]))[0]
+        return simulated_observations(history, P["t_d"])
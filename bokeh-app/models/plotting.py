@@ -0,0 +1,52 @@
+import numpy as np
+from bokeh.events import RangesUpdate
+from bokeh.models import ColumnDataSource
+
+from ..core.downsample import downsample_indices
+
+
+class DownsampledSource:
+    """ColumnDataSource of the series of one figure, each reduced to about `pixel_budget` points.
+
+    The full series stay on the server. When the figure is zoomed or panned, the visible window is reduced again to
+    `pixel_budget` points so the detail comes back, see downsample_indices. Columns are float64 NumPy arrays, which
+    Bokeh sends to the browser as binary buffers.
+    """
+    def __init__(self, x_key, keys, pixel_budget=800, method="lttb"):
+        self.x_key = x_key
+        self.keys = list(keys)
+        self.pixel_budget = pixel_budget
+        self.method = method
+        self.columns = {key: np.empty(0) for key in [x_key] + self.keys}
+        self.window = None
+        self.source = ColumnDataSource(data=dict(self.columns))
+
+    def attach(self, figure):
+        figure.on_event(RangesUpdate, self.update_window)
+        return self.source
+
+    def set_data(self, columns, sent=False):
+        # `sent` when the source already has every row of columns, as streamed
+        self.columns = {key: np.ascontiguousarray(columns[key], dtype=float) for key in self.columns}
+        self.window = None
+        self.resample(sent)
+
+    def stream(self, columns):
+        self.source.stream({key: np.ascontiguousarray(columns[key], dtype=float) for key in self.columns})
+
+    def resample(self, sent=False):
+        x = self.columns[self.x_key]
+        indices = downsample_indices(x, [self.columns[key] for key in self.keys], self.pixel_budget, self.method,
+                                     self.window)
+        if len(indices) == len(x):
+            if not sent:
+                self.source.data = dict(self.columns)
+            return
+        self.source.data = {key: values[indices] for key, values in self.columns.items()}
+
+    def update_window(self, event):
+        # Every point of short series is already shown
+        if len(self.columns[self.x_key]) <= self.pixel_budget or event.x0 is None or event.x1 is None:
+            return
+        self.window = (min(event.x0, event.x1), max(event.x0, event.x1))
+        self.resample()
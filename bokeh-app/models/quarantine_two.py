@@ -1,103 +1,302 @@
-from collections import defaultdict
-from itertools import chain
+from operator import add
+from time import perf_counter
 
 from bokeh.plotting import figure
 from bokeh.layouts import column, row
-from bokeh.models import TextInput, Slider, Panel, Tabs, HoverTool, ColumnDataSource
+from bokeh.models import TextInput, Panel, Tabs, HoverTool, ColumnDataSource, Select, Button, Div
+from bokeh.transform import dodge
+import numpy as np
 import pandas as pd
 
 from .base import BaseModel
-
-#TODO: move this to a helper library
-def divide_by_hundred(x):
-    return x / 100
-
-pop_control_ui_params = {"S": {"widget": TextInput, "kwargs": {"value": "7278717", "title": "Susceptible Population"}, "type": int},
-                         "NI_RNT": {"widget": TextInput, "kwargs": {"value": "10", "title": "Native or Recovered Immune"}, "type": int},
-                         "IAS": {"widget": TextInput, "kwargs": {"value": "10", "title": "Infected-Asymptomatic"}, "type": int},
-                         "IPS": {"widget": TextInput, "kwargs": {"value": "10", "title": "Infected-PreSymptomatic"}, "type": int},
-                         "IS": {"widget": TextInput, "kwargs": {"value": "10", "title": "Infected-Symptomatic"}, "type": int}
-                         }
-
-non_ui_stocks = ["S_TWR", "NI_TWR", "IA_TWR", "IPS_TWR", "IS_TWR", "IAS_CCP", "IPS_CCP", "IS_CCP", "D", "RWT"]
-all_stock_keys = list(pop_control_ui_params.keys()) + non_ui_stocks
-spread_factors_control_panel_ui_params = {
-    "beta": {"widget": TextInput, "kwargs": {"value": "0.304", "title": "beta: Infection Rate"}, "type": float},
-    "x": {"widget": TextInput, "kwargs": {"value": "1e-5", "title": "x: % of No-Symptom Tested"}, "type": float},
-    "y": {"widget": TextInput, "kwargs": {"value": "0.5", "title": "y: % of Symptom Tested"}, "type": float},
-    "t_d": {"widget": Slider, "kwargs": {"start": 1, "end": 14, "value": 3, "step": 1, "title": "Testing Delay(days)"}, "type": float},
-    "t_i": {"widget": Slider, "kwargs": {"start": 1, "end": 14, "value": 14, "step": 1, "title": "Recovery Delay(days)"}, "type": float},
-    "t_l": {"widget": Slider, "kwargs": {"start": 1, "end": 14, "value": 1, "step": 1, "title": "Latency Period Delay(days)"}, "type": float},
-    "t_p": {"widget": Slider, "kwargs": {"start": 1, "end": 14, "value": 4, "step": 1, "title": "Presymptomatic Period Delay(days)"}, "type": float},
-    "t_c": {"widget": Slider, "kwargs": {"start": 1, "end": 14, "value": 1, "step": 1, "title": "Delay till Taking Test(days)"}, "type": float},
-    "p_sa": {"widget": Slider, "kwargs": {"start": 0, "end": 100, "value": 100, "step": 1, "title": "Serological Attack Prob(%)"}, "type": float, "post_ui_process": divide_by_hundred},
-    "p_a": {"widget": Slider, "kwargs": {"start": 0, "end": 100, "value": 60, "step": 1, "title": "Asymptomatic infection probability(%)"}, "type": float, "post_ui_process": divide_by_hundred},
-    "p_r": {"widget": Slider, "kwargs": {"start": 0, "end": 100, "value": 98, "step": 1, "title": "Recovery Prob(%)"}, "type": float, "post_ui_process": divide_by_hundred},
-    "NumDays": {"widget": Slider, "kwargs": {"start": 1, "end": 760, "value": 200, "step": 10, "title": "Simulation Steps(days)"}, "type": int}
+from .cache import ResultCache
+from .plotting import DownsampledSource
+from .stockflow import StockFlowControls
+from ..core.metrics import timed, increment
+from ..core.quarantine_two import history_keys, headline_output_keys, quarantine_two_spec, engine_modes, default_stocks, \
+    default_parameters
+
+# Titles, ranges and scaling of the widgets that differ from a TextInput titled by the name of its stock or parameter
+quarantine_two_ui_overrides = {
+    "S": {"title": "Susceptible Population"},
+    "NI_RNT": {"title": "Native or Recovered Immune"},
+    "IAS": {"title": "Infected-Asymptomatic"},
+    "IPS": {"title": "Infected-PreSymptomatic"},
+    "IS": {"title": "Infected-Symptomatic"},
+    "beta": {"title": "beta: Infection Rate"},
+    "x": {"title": "x: % of No-Symptom Tested"},
+    "y": {"title": "y: % of Symptom Tested"},
+    "t_d": {"title": "Testing Delay(days)", "range": (1, 14)},
+    "t_i": {"title": "Recovery Delay(days)", "range": (1, 14)},
+    "t_l": {"title": "Latency Period Delay(days)", "range": (1, 14)},
+    "t_p": {"title": "Presymptomatic Period Delay(days)", "range": (1, 14)},
+    "t_c": {"title": "Delay till Taking Test(days)", "range": (1, 14)},
+    "p_sa": {"title": "Serological Attack Prob(%)", "range": (0, 100), "scale": 100},
+    "p_a": {"title": "Asymptomatic infection probability(%)", "range": (0, 100), "scale": 100},
+    "p_r": {"title": "Recovery Prob(%)", "range": (0, 100), "scale": 100},
+    "NumDays": {"title": "Simulation Steps(days)", "range": (1, 760), "step": 10}
 }
 
+quarantine_two_controls = StockFlowControls(quarantine_two_spec, default_stocks, default_parameters,
+                                            quarantine_two_ui_overrides)
+
+
+def add_derived_columns(hist_df):
+    hist_df["NI/RNT+RWT"] = hist_df["NI_RNT"] + hist_df["RWT"]
+    hist_df["IS-Total"] = hist_df["IS"] + hist_df["IS_TWR"] + hist_df["IS_CCP"]
+    # The index is the day of each row, engines recording with a stride leave days out in between
+    hist_df["Day"] = hist_df.index
+    return hist_df
+
+
+def summary_values(hist_df):
+    # Scalars of a whole run, shown in the tooltips instead of being repeated on every row
+    stride = hist_df.index[1] - hist_df.index[0] if len(hist_df) > 1 else 1
+    return {"IS-Max": hist_df["IS-Total"].max(), "IS-AUC": hist_df["IS-Total"].sum() * stride}
+
+
+# How the summary of the days streamed so far is combined with the summary of the next days
+running_summaries = {"IS-Max": max, "IS-AUC": add}
+
+
+def abbreviated(value):
+    # Same as the "0.00 a" format of the tooltip fields
+    for suffix, size in (("t", 1e12), ("b", 1e9), ("m", 1e6), ("k", 1e3)):
+        if abs(value) >= size:
+            return "{:.2f} {}".format(value / size, suffix)
+    return "{:.2f}".format(value)
+
+
+def column_data(hist_df):
+    # ColumnDataSource data of a frame, ColumnDataSource.from_df would copy the whole frame first
+    return {key: hist_df[key].values for key in hist_df.columns}
+
 
 class QuarantineTwo(BaseModel):
-    def __init__(self):
-        self.engine = QuarantineTwoEngine()
-        self.source = ColumnDataSource()
+    def __init__(self, engine_mode="vector", cache=None, store=None):
+        self.engine_mode = engine_mode
+        self.engine = engine_modes[engine_mode]()
+        # Keys of the rows the engine streams to the plots
+        self.history_keys = history_keys
+        # One source per figure, each downsampled to the width of its figure
+        self.plot_sources = [DownsampledSource("Day", ["S", "NI/RNT+RWT", "D"]), DownsampledSource("Day", ["IS-Total"]),
+                             DownsampledSource("Day", ["D"])]
+        self.summary = {"IS-Max": np.nan, "IS-AUC": np.nan}
+        self.summary_hover_tools = []
+        self.cache = cache if cache is not None else ResultCache()
+        self.store = store
+        self.hist_df = None
+        # The figures of each y axis type, only those of the current one are visible
+        self.plot_figures = dict()
+        self.plot_tabs = None
+
+    def set_engine_mode(self, engine_mode):
+        self.engine_mode = engine_mode
+        self.engine = engine_modes[engine_mode]()
+
+    def cache_name(self):
+        # Engines give different results for the same inputs
+        return "{}/{}".format(type(self).__name__, self.engine_mode)
 
     def dynamic_control_panel(self):
         # Population Control UI
-        pop_control_panel = column(sizing_mode="stretch_width")
-        for id, ui_item in pop_control_ui_params.items():
-            new_ui_item = ui_item["widget"](id=id, **ui_item["kwargs"])
-            pop_control_panel.children.append(new_ui_item)
+        pop_control_panel = column(*quarantine_two_controls.stock_widgets(), sizing_mode="stretch_width")
 
         # Spread Factors UI
-        spread_factors_panel = column(sizing_mode="stretch_width")
-        for id, ui_item in spread_factors_control_panel_ui_params.items():
-            new_ui_item = ui_item["widget"](id=id, **ui_item["kwargs"])
-            spread_factors_panel.children.append(new_ui_item)
+        spread_factors_panel = column(*quarantine_two_controls.parameter_widgets(), sizing_mode="stretch_width")
 
         return row(Tabs(tabs=[Panel(child=pop_control_panel, title="Initial Variables of Stocks"),
                               Panel(child=spread_factors_panel, title="Parameters")]), id="dynamic-control-panel")
 
+    def result_keys(self, population_initials_dict, spread_factors_dict):
+        # Keys are taken before running since the engines may add entries such as P["N"]
+        cache_key = self.cache.key(self.cache_name(), population_initials_dict, spread_factors_dict)
+        store_key = self.store.key(self.cache_name(), population_initials_dict, spread_factors_dict) if self.store else None
+        return cache_key, store_key
+
+    def cached_result(self, keys):
+        # The session cache first, then the results shared by every session of the server
+        cache_key, store_key = keys
+        hist_df = self.cache.get(cache_key)
+        if hist_df is None and self.store is not None:
+            history = self.store.get(store_key)
+            if history is not None:
+                hist_df = self.derived_columns(pd.DataFrame(history, columns=self.history_keys, copy=False))
+                self.cache.put(cache_key, hist_df)
+        return hist_df
+
+    def save_result(self, keys, hist_df):
+        cache_key, store_key = keys
+        self.cache.put(cache_key, hist_df)
+        if self.store is not None:
+            self.store.put(store_key, hist_df[self.history_keys].values)
+
     def run_with_the_input_from_control_panel(self, control_panel):
-        self.engine.run(*self.parse_control_panel_values_to_engine_init(control_panel))
+        self.run_days(self.start_streaming_run(control_panel))
+
+    def run_scenario(self, population_initials_dict, spread_factors_dict):
+        keys = self.result_keys(population_initials_dict, spread_factors_dict)
+        self.hist_df = self.cached_result(keys)
+        if self.hist_df is None:
+            increment("ncov_model_runs_total", engine=self.engine_mode)
+            self.engine.run(population_initials_dict, spread_factors_dict)
+            self.hist_df = self.derived_columns(self.engine.history_as_pandas_df())
+            self.save_result(keys, self.hist_df)
+
+    def start_streaming_run(self, control_panel, executor=None):
+        # Returns an iterator over the days of the run, or None when the result is cached and there is nothing to stream
+        return self.start_run(*self.parse_control_panel_values_to_engine_init(control_panel), executor)
+
+    def engine_factory(self):
+        # Builds self.engine in the worker processes of a StreamPool, so it must be picklable
+        return engine_modes[self.engine_mode]
+
+    def iter_days(self, population_initials_dict, spread_factors_dict, executor=None):
+        # Days of self.engine, computed by the StreamPool `executor` when given
+        if executor is not None:
+            return executor.iter_run(self.engine_factory(), population_initials_dict, spread_factors_dict)
+        return self.engine.iter_run(population_initials_dict, spread_factors_dict)
+
+    def start_run(self, population_initials_dict, spread_factors_dict, executor=None):
+        # start_streaming_run of a scenario
+        self.stream_keys = self.result_keys(population_initials_dict, spread_factors_dict)
+        self.hist_df = self.cached_result(self.stream_keys)
+        if self.hist_df is not None:
+            return None
+        increment("ncov_model_runs_total", engine=self.engine_mode)
+        self.start_stream(spread_factors_dict["NumDays"])
+        return self.iter_days(population_initials_dict, spread_factors_dict, executor)
+
+    def start_stream(self, num_days):
+        # Days are written into one buffer as they come, the frames streamed and kept at the end are views of it
+        self.stream_history = np.empty((int(num_days), len(self.history_keys)), order="F")
+        self.stream_days = 0
+        self.show_plot_data(self.derived_columns(pd.DataFrame(columns=self.history_keys, dtype=float)))
+
+    def run_days(self, days):
+        # Computes and plots every day of start_run at once, when there is no event loop to stream them to
+        if days is not None:
+            self.push_days(list(days), True)
+
+    @staticmethod
+    def take_days(days, time_budget=0.02):
+        # Computes days for up to time_budget seconds, does not touch any Bokeh model so it can run off the event loop
+        rows = []
+        deadline = perf_counter() + time_budget
+        for values in days:
+            rows.append(values)
+            if perf_counter() > deadline:
+                return rows, False
+        return rows, True
+
+    def push_days(self, rows, finished):
+        # Streams the rows returned by take_days to the plots
+        start = self.stream_days
+        self.stream_days += len(rows)
+        if rows:
+            self.stream_history[start:self.stream_days] = rows
+            chunk_df = pd.DataFrame(self.stream_history[start:self.stream_days], columns=self.history_keys,
+                                    index=range(start, self.stream_days), copy=False)
+            columns = column_data(self.derived_columns(chunk_df))
+            for plot_source in self.plot_sources:
+                plot_source.stream(columns)
+            # IS-Max and IS-AUC are running values until the whole series is known
+            summary = self.summary_values(chunk_df)
+            if start:
+                summary = {key: running_summaries[key](self.summary[key], value) for key, value in summary.items()}
+            self.show_summary(summary)
+
+        if finished:
+            self.hist_df = self.derived_columns(pd.DataFrame(self.stream_history[:self.stream_days],
+                                                             columns=self.history_keys, copy=False))
+            self.save_result(self.stream_keys, self.hist_df)
+            # Every day is plotted already, the sources are only reduced when there are more days than pixels
+            self.show_plot_data(self.hist_df, sent=True)
 
     def parse_control_panel_values_to_engine_init(self, control_panel):
         pop_control_panel, spread_factors = control_panel.children[0].tabs[0].child, control_panel.children[0].tabs[1].child
-        population_initials_dict = {key: int(value) for key, value in zip(list(pop_control_ui_params.keys()), [child.value for child in pop_control_panel.children])}
-        spread_factors_dict = dict()
-        for dict_item, new_value in zip(list(spread_factors_control_panel_ui_params.items()), [child.value for child in spread_factors.children]):
-            key, post_ui_process, type = dict_item[0], dict_item[1].get("post_ui_process", None), dict_item[1].get("type")
-            if post_ui_process:
-                new_value = post_ui_process(type(new_value))
-            else:
-                new_value = type(new_value)
-            spread_factors_dict[key] = new_value
-        return population_initials_dict, spread_factors_dict
+        return quarantine_two_controls.parse_widgets(pop_control_panel.children, spread_factors.children)
+
+    def load_into_control_panel(self, control_panel, values):
+        pop_control_panel, spread_factors = control_panel.children[0].tabs[0].child, control_panel.children[0].tabs[1].child
+        quarantine_two_controls.set_widgets(pop_control_panel.children, spread_factors.children, values, values)
+
+    def derived_columns(self, hist_df):
+        return add_derived_columns(hist_df)
+
+    def summary_values(self, hist_df):
+        return summary_values(hist_df)
+
+    def show_plot_data(self, hist_df, sent=False):
+        columns = column_data(hist_df)
+        for plot_source in self.plot_sources:
+            plot_source.set_data(columns, sent)
+        self.show_summary(self.summary_values(hist_df))
+
+    def show_summary(self, summary):
+        self.summary = summary
+        for hover_tool in self.summary_hover_tools:
+            hover_tool.tooltips = self.summary_tooltips()
+
+    def summary_tooltips(self):
+        return [('Day', '@Day'),
+                ('IS-Total', '@{IS-Total}{0.00 a}')] + \
+               [(key, abbreviated(value)) for key, value in self.summary.items() if not np.isnan(value)]
 
+    @timed("QuarantineTwo.plot_panel")
     def plot_panel(self, y_scale="linear"):
+        # Figures are built once per model, later runs only replace the data of self.plot_sources
+        if self.plot_tabs is None:
+            self.plot_tabs = self.build_plot_panel()
+        if self.hist_df is not None:
+            self.show_plot_data(self.hist_df)
+        self.set_y_scale(y_scale)
+        return self.plot_tabs
+
+    def set_y_scale(self, y_scale):
+        # BokehJS maps data with the scale a figure was first rendered with, so scales are switched by showing the
+        # figures built for the other y axis type instead of replacing their y_scale
+        for y_axis_type, figures in self.plot_figures.items():
+            for p in figures:
+                p.visible = y_axis_type == y_scale
+
+    def build_plot_panel(self):
+        # The linear figures are shown first, both figures of a plot share its x range so zooms carry over
+        linear = self.build_figures("linear")
+        log = self.build_figures("log", x_ranges=[p.x_range for p in linear])
+        self.plot_figures = {"linear": linear, "log": log}
+        self.set_y_scale("linear")
+        (p1, p2, p3), (log_p1, log_p2, log_p3) = linear, log
+        panel_p1 = Panel(child=column(p1, log_p1, p3, log_p3), title="Plot 1")
+        panel_p2 = Panel(child=column(p2, log_p2), title="Plot 2")
+        tabs = Tabs(tabs=[panel_p1, panel_p2])
+        # TODO, plot panel sizingmode margin etc should be set in main.py
+        return tabs
+        # return column(*(tabs,), sizing_mode="scale_width", background="whitesmoke", id="plot-panel")
+
+    def new_figures(self, y_axis_type, x_ranges=None):
+        # Plot 1, Plot 2 and Deads with their sources, sharing x_ranges when given
+        x_ranges = x_ranges or [None] * 3
+        figures = [figure(title=title, aspect_ratio=2, plot_width=800, margin=10, y_axis_type=y_axis_type,
+                          **({"x_range": x_range} if x_range is not None else {}))
+                   for title, x_range in zip(["Plot 1", "Plot 2", "Deads"], x_ranges)]
+        sources = [plot_source.attach(p) for plot_source, p in zip(self.plot_sources, figures)]
+        return figures, sources
+
+    def build_figures(self, y_axis_type, x_ranges=None):
         #TODO: put legend outside of figure
         #TODO: Plot 2 needs sliders for x and y +
         #TODO: daily and total tests sed on hover
         #TODO: quarantine one, TWR is involved in TI
         #TODO: quarantine three, IS is not involved in TI
-        p1 = figure(title="Plot 1", aspect_ratio=2, plot_width=800, margin=10, y_axis_type=y_scale)
-        p2 = figure(title="Plot 2", aspect_ratio=2, plot_width=800, margin=10, y_axis_type=y_scale)
-        p3 = figure(title="Deads", aspect_ratio=2, plot_width=800, margin=10, y_axis_type=y_scale)
-
-        hist_df = self.engine.history_as_pandas_df()
-        hist_df["NI/RNT+RWT"] = hist_df["NI_RNT"] + hist_df["RWT"]
-        hist_df["IS-Total"] = hist_df["IS"] + hist_df["IS_TWR"] + hist_df["IS_CCP"]
-        hist_df["IS-Max"] = hist_df["IS-Total"].max()
-        hist_df["IS-AUC"] = hist_df["IS-Total"].sum()
-        hist_df["Day"] = pd.Series(range(len(hist_df)))
-
-        self.source = ColumnDataSource(hist_df)
+        (p1, p2, p3), (source_p1, source_p2, source_p3) = self.new_figures(y_axis_type, x_ranges)
+
         renderer_line_key = "S"
         for key, line_color in zip(["S", "NI/RNT+RWT", "D"], ["blue", "green", "red"]):
             if key == renderer_line_key:
-                renderer_line = p1.line("Day", key, source=self.source, line_color=line_color, legend_label=key)
+                renderer_line = p1.line("Day", key, source=source_p1, line_color=line_color, legend_label=key)
             else:
-                p1.line("Day", key, source=self.source, line_color=line_color, legend_label=key)
+                p1.line("Day", key, source=source_p1, line_color=line_color, legend_label=key)
 
         hover_tool = HoverTool(
             tooltips=[
@@ -112,21 +311,18 @@ class QuarantineTwo(BaseModel):
         )
         p1.add_tools(hover_tool)
 
-        p2.line("Day", "IS-Total", source=self.source, legend_label="IS-Total")
+        p2.line("Day", "IS-Total", source=source_p2, legend_label="IS-Total")
 
-        hover_tool = HoverTool(
-            tooltips=[
-                ('Day', '@Day'),
-                ('IS-Total', '@{IS-Total}{0.00 a}'),
-                ('IS-Max', '@{IS-Max}{0.00 a}'),
-                ('IS-AUC', '@{IS-AUC}{0.00 a}'),
-            ],
+        summary_hover_tool = HoverTool(
+            # IS-Max and IS-AUC are the same on every day, they are written into the tooltips of each run
+            tooltips=self.summary_tooltips(),
             # display a tooltip whenever the cursor is vertically in line with a glyph
             mode='vline'
         )
-        p2.add_tools(hover_tool)
+        self.summary_hover_tools.append(summary_hover_tool)
+        p2.add_tools(summary_hover_tool)
 
-        p3.line("Day", "D", source=self.source, legend_label="Dead", line_color="red")
+        p3.line("Day", "D", source=source_p3, legend_label="Dead", line_color="red")
         hover_tool = HoverTool(
             tooltips=[
                 ('Day', '@Day'),
@@ -136,87 +332,81 @@ class QuarantineTwo(BaseModel):
             mode='vline'
         )
         p3.add_tools(hover_tool)
-
-        panel_p1 = Panel(child=column(p1, p3), title="Plot 1")
-        panel_p2 = Panel(child=p2, title="Plot 2")
-        tabs = Tabs(tabs=[panel_p1, panel_p2])
-        # TODO, plot panel sizingmode margin etc should be set in main.py
-        return tabs
-        # return column(*(tabs,), sizing_mode="scale_width", background="whitesmoke", id="plot-panel")
-
-
-class QuarantineTwoEngine:
-    def __init__(self):
-        self.history = defaultdict(list)
-
-    def run(self, S, P):
-        A = dict()  # AUXILIARY VARIABLES
-        P["N"] = 0
-        for name, init_value in S.items():
-            # Total population is the sum of each initial non-zero stock that comes from the UI
-            P["N"] += init_value
-
-        for name in non_ui_stocks:
-            # We assume stocks outside UI begin at 0
-            S[name] = 0
-
-        for step in range(1, P["NumDays"]+1):
-            # Compute Auxiliaries
-            A = self.compute_auxiliaries(A, S, P)
-            # Record History of Each Stock and Auxiliary Variable
-            self.record_history(S, A)
-            # Update Stocks
-            S.update(self.update_stocks(S, A, P))
-
-            # TODO: do we have to post process stock to see if there is any negative?
-
-    def update_stocks(self, S: dict, A: dict, P: dict):
-        # TODO: consider unpacking S, A and P here
-        S_NEW = defaultdict(float)
-        # Eq [1]
-        S_NEW["S"] = S["S"] + (S["S_TWR"] / P["t_d"]) - (P["x"] * S["S"]) - A["E"]
-        # Eq [2]
-        S_NEW["S_TWR"] = S["S_TWR"] + (P["x"] * S["S"])- (S["S_TWR"] / P["t_d"])
-        # Eq [3]
-        S_NEW["NI_RNT"] = S["NI_RNT"] + ((1 - P["p_sa"]) * A["E"]) + (S["IAS"] / P["t_i"]) + (P["p_r"] * S["IS"] / P["t_i"]) + (S["NI_TWR"] / P["t_d"]) - (P["x"] * S["NI_RNT"])
-        # Eq [4]
-        S_NEW["NI_TWR"] = S["NI_TWR"] + (P["x"] * S["NI_RNT"]) - (S["NI_TWR"] / P["t_d"])
-        # Eq [5]
-        S_NEW["IPS"] = S["IPS"] + (P["p_sa"] * A["E"]) - (P["x"] * S["IPS"]) - (S["IPS"] / P["t_p"])
-        # Eq [6]
-        S_NEW["IAS"] = S["IAS"] + (P["p_a"] * S["IPS"] / P["t_p"]) - (S["IAS"] / P["t_i"]) - (P["x"] * S["IAS"])
-        # Eq [7]
-        S_NEW["IS"] = S["IS"] + ((1 - P["p_a"]) * S["IPS"] / P["t_p"]) - (S["IS"] / P["t_i"]) - (P["y"] * S["IS"])
-        # Eq [8]
-        S_NEW["IA_TWR"] = S["IA_TWR"] + P["x"] * S["IAS"] + P["p_a"] * S["IPS_TWR"] / P["t_p"] - S["IA_TWR"] / P["t_d"] - S["IA_TWR"] / P["t_i"]
-        # Eq [9]
-        S_NEW["IPS_TWR"] = S["IPS_TWR"] + P["x"] * S["IPS"] - S["IPS_TWR"] / P["t_d"] - S["IPS_TWR"] / P["t_p"]
-        # Eq [10]
-        S_NEW["IS_TWR"] = S["IS_TWR"] + P["y"] * S["IS"] + (1 - P["p_sa"]) * S["IPS_TWR"] / P["t_p"] - S["IS_TWR"] / P["t_d"] - S["IS_TWR"] / P["t_i"]
-        # Eq [11]
-        S_NEW["IAS_CCP"] = S["IAS_CCP"] + S["IA_TWR"] / P["t_d"] + P["p_a"] * S["IPS_CCP"] / P["t_p"] - S["IAS_CCP"] / P["t_i"]
-        # Eq [12]
-        S_NEW["IS_CCP"] = S["IS_CCP"] + S["IS_TWR"] / P["t_d"] + (1- P["p_a"]) * S["IPS_CCP"] / P["t_p"] - S["IS_CCP"] / P["t_i"]
-        # Eq [13]
-        S_NEW["IPS_CCP"] = S["IPS_CCP"] + S["IPS_TWR"] / P["t_d"] - S["IPS_CCP"] / P["t_p"]
-        # Eq [14]
-        S_NEW["RWT"] = S["RWT"] + S["IA_TWR"] / P["t_i"] + P["p_r"] * S["IS_TWR"] / P["t_i"] + S["IAS_CCP"] / P["t_i"] + P["p_r"] * S["IS_CCP"] / P["t_i"]
-        # Eq [15]
-        S_NEW["D"] = S["D"] + (1 - P["p_r"]) * S["IS"] / P["t_i"] + (1 - P["p_r"]) * S["IS_TWR"] / P["t_i"] + (1 - P["p_r"]) * S["IS_CCP"] / P["t_i"]
-        return S_NEW
-
-    def compute_auxiliaries(self, A, S, P):
-        # Total Infected
-        A["TI"] = sum([S[key] for key in ["IAS", "IPS", "IS"]])
-        # Exposed
-        A["E"] = S["S"] * A["TI"] * P["beta"] / P["N"]
-        return A
-
-    def record_history(self, S, A):
-        for key, value in chain(S.items(), A.items()):
-            self.history[key].append(value)
-
-    def history_as_pandas_df(self):
-        return pd.DataFrame(self.history)
-
-
+        return [p1, p2, p3]
+
+    def sensitivity_panel(self):
+        # Imported here since the sensitivity module builds on this one
+        from .sensitivity import sensitivity_parameter_keys, sensitivity_methods
+        self.sensitivity_method = Select(title="Method", value=sensitivity_methods[0], options=sensitivity_methods)
+        self.sensitivity_samples = TextInput(value="256", title="Base Samples (Sobol) / Trajectories (Morris)")
+        self.sensitivity_seed = TextInput(value="0", title="Seed")
+        self.sensitivity_output = Select(title="Output", value=headline_output_keys[0], options=headline_output_keys)
+        self.sensitivity_button = Button(label="Run Sensitivity", button_type="success")
+        self.sensitivity_status = Div(text="")
+        self.sensitivity_result = None
+
+        self.sensitivity_source = ColumnDataSource(data={"parameter": sensitivity_parameter_keys,
+                                                         "first": [0] * len(sensitivity_parameter_keys),
+                                                         "second": [0] * len(sensitivity_parameter_keys)})
+        self.sensitivity_figure = figure(title="Sensitivity", x_range=sensitivity_parameter_keys, aspect_ratio=2,
+                                         plot_width=800, margin=10)
+        self.sensitivity_figure.vbar(x=dodge("parameter", -0.2, range=self.sensitivity_figure.x_range), top="first",
+                                     width=0.35, source=self.sensitivity_source, color="blue")
+        self.sensitivity_figure.vbar(x=dodge("parameter", 0.2, range=self.sensitivity_figure.x_range), top="second",
+                                     width=0.35, source=self.sensitivity_source, color="orange")
+        self.sensitivity_output.on_change("value", lambda attr, old, new: self.show_sensitivity(self.sensitivity_result))
+
+        controls = row(self.sensitivity_method, self.sensitivity_samples, self.sensitivity_seed, self.sensitivity_output)
+        return column(controls, row(self.sensitivity_button, self.sensitivity_status), self.sensitivity_figure,
+                      sizing_mode="scale_width")
+
+    def sensitivity_inputs(self):
+        return self.sensitivity_method.value, int(self.sensitivity_samples.value), int(self.sensitivity_seed.value)
+
+    def show_sensitivity(self, result):
+        self.sensitivity_result = result
+        if result is None:
+            return
+        indices = result["indices"][self.sensitivity_output.value]
+        first_key, second_key = indices.keys()
+        self.sensitivity_figure.title.text = "{} of {}: {} (blue), {} (orange)".format(
+            result["method"], self.sensitivity_output.value, first_key, second_key)
+        self.sensitivity_source.data = {"parameter": result["parameters"],
+                                        "first": indices[first_key], "second": indices[second_key]}
+
+    def calibration_panel(self):
+        self.calibration_path = TextInput(value="observed.csv", title="Observed CSV (day or date, cases, deaths)")
+        self.calibration_starts = TextInput(value="8", title="Starts")
+        self.calibration_seed = TextInput(value="0", title="Seed")
+        self.calibration_button = Button(label="Fit", button_type="success")
+        self.calibration_load_button = Button(label="Load into Control Panel", disabled=True)
+        self.calibration_status = Div(text="")
+        self.calibration_result = None
+
+        self.calibration_source = ColumnDataSource(data={"Day": [], "cases": [], "deaths": [],
+                                                         "fitted_cases": [], "fitted_deaths": []})
+        self.calibration_figure = figure(title="Observed (dots) and Fitted (lines)", x_axis_label="Day",
+                                         aspect_ratio=2, plot_width=800, margin=10)
+        for key, color in (("cases", "blue"), ("deaths", "red")):
+            self.calibration_figure.circle(x="Day", y=key, source=self.calibration_source, color=color, legend_label=key)
+            self.calibration_figure.line(x="Day", y="fitted_" + key, source=self.calibration_source, color=color,
+                                         legend_label=key)
+        self.calibration_figure.legend.location = "top_left"
+
+        controls = row(self.calibration_path, self.calibration_starts, self.calibration_seed)
+        return column(controls, row(self.calibration_button, self.calibration_load_button, self.calibration_status),
+                      self.calibration_figure, sizing_mode="scale_width")
+
+    def calibration_inputs(self):
+        return self.calibration_path.value, int(self.calibration_starts.value), int(self.calibration_seed.value)
+
+    def show_calibration(self, result, observed, simulated):
+        self.calibration_result = result
+        self.calibration_load_button.disabled = result is None
+        if result is None:
+            return
+        days = np.arange(len(simulated))
+        observed = observed.reindex(days)
+        self.calibration_source.data = {"Day": days, "cases": observed["cases"].values,
+                                        "deaths": observed["deaths"].values,
+                                        "fitted_cases": simulated[:, 0], "fitted_deaths": simulated[:, 1]}
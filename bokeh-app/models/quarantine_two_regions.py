@@ -0,0 +1,135 @@
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from bokeh.layouts import column
+from bokeh.models import TextInput, Select, Div, Panel
+
+from .quarantine_two import QuarantineTwo
+from ..core.metrics import increment
+from ..core.metapopulation import QuarantineTwoMetapopulationEngine, read_regions, read_mobility, \
+    mobility_matrix
+
+# Only the stocks the plots are derived from are kept for every region
+region_history_keys = ["S", "NI_RNT", "RWT", "D", "IS", "IS_TWR", "IS_CCP"]
+all_regions = "All regions"
+
+
+class QuarantineTwoRegions(QuarantineTwo):
+    """QuarantineTwo over the regions of a CSV file, coupled by a mobility CSV file, see core.metapopulation.
+
+    The stocks and parameters of the control panel are the values of every region the regions file leaves out, and
+    the only region without a regions file. Runs take daily steps whatever the solver. The plots show one region or
+    the sum over all of them, switching between them does not rerun the model. Results depend on the files, so they
+    are neither cached nor shared.
+    """
+    def __init__(self, engine_mode="vector", cache=None, store=None):
+        super().__init__(engine_mode, cache=cache, store=None)
+        self.history_keys = region_history_keys
+        self.region_names = []
+        self.mobility = None
+        self.region_days = 0
+        self.regions_path = TextInput(value="", title="Regions CSV (region, stocks and parameters)")
+        self.mobility_path = TextInput(value="", title="Mobility CSV (source, target, share)")
+        self.region_select = Select(title="Region", value=all_regions, options=[all_regions])
+        self.region_select.on_change("value", self.show_region)
+        self.regions_status = Div(text="")
+
+    def set_engine_mode(self, engine_mode):
+        # Regions always take daily steps, the engine of a run is made from its regions
+        self.engine_mode = engine_mode
+
+    def cache_name(self):
+        return type(self).__name__
+
+    def dynamic_control_panel(self):
+        control_panel = super().dynamic_control_panel()
+        regions_panel = column(self.regions_path, self.mobility_path, self.region_select, self.regions_status,
+                               sizing_mode="stretch_width")
+        control_panel.children[0].tabs.append(Panel(child=regions_panel, title="Regions"))
+        return control_panel
+
+    def read_scenario(self, control_panel):
+        # (names, mobility, S, P) of the regions files on top of the control panel scenario
+        S, P = self.parse_control_panel_values_to_engine_init(control_panel)
+        if not self.regions_path.value.strip():
+            names, S, P = ["Region 1"], S, P
+        else:
+            names, S, P = read_regions(self.regions_path.value.strip(), S, P)
+        if self.mobility_path.value.strip():
+            mobility = read_mobility(self.mobility_path.value.strip(), names)
+        else:
+            # Nobody travels
+            mobility = mobility_matrix([], [], [], len(names))
+        return names, mobility, S, P
+
+    def run_scenario(self, population_initials_dict, spread_factors_dict, names=None, mobility=None):
+        """Run the regions `names`, coupled by the sparse matrix `mobility` of mobility_matrix.
+
+        Stocks and parameters are scalars, the same in every region, or arrays over the regions like read_regions
+        returns. Without names there is a single region, without mobility nobody travels.
+        """
+        names = list(names or ["Region 1"])
+        self.set_regions(names, mobility_matrix([], [], [], len(names)) if mobility is None else mobility)
+        self.run_days(self.start_run(population_initials_dict, spread_factors_dict))
+
+    def start_streaming_run(self, control_panel, executor=None):
+        try:
+            names, mobility, S, P = self.read_scenario(control_panel)
+        except (OSError, ValueError) as e:
+            self.regions_status.text = "Failed: {}".format(e)
+            return None
+        self.set_regions(names, mobility)
+        return self.start_run(S, P, executor)
+
+    def set_regions(self, names, mobility):
+        edges = mobility.nnz - np.count_nonzero(mobility.diagonal())
+        self.regions_status.text = "{} regions, {} mobility edges".format(len(names), edges)
+        self.region_names = names
+        self.mobility = mobility
+        self.region_select.options = [all_regions] + names
+        if self.region_select.value not in self.region_select.options:
+            self.region_select.value = all_regions
+
+    def engine_factory(self):
+        return partial(QuarantineTwoMetapopulationEngine, self.mobility, record_keys=region_history_keys,
+                       dtype=np.float32)
+
+    def start_run(self, population_initials_dict, spread_factors_dict, executor=None):
+        # Regions of set_regions, every run is computed
+        increment("ncov_model_runs_total", engine="metapopulation")
+        # Holds the days of every region, whichever process computes them
+        self.engine = self.engine_factory()()
+        self.engine.allocate_history(spread_factors_dict["NumDays"])
+        self.region_days = 0
+        self.hist_df = None
+        self.stream_keys = None
+        self.start_stream(spread_factors_dict["NumDays"])
+        return self.iter_days(population_initials_dict, spread_factors_dict, executor)
+
+    def region_view(self, history):
+        # (..., regions, keys) values of the selected region, or their sum over the regions
+        if self.region_select.value == all_regions:
+            return history.sum(axis=-2)
+        return history[..., self.region_names.index(self.region_select.value), :]
+
+    def push_days(self, rows, finished):
+        start = self.region_days
+        self.region_days += len(rows)
+        if rows:
+            self.engine.history[start:self.region_days] = rows
+        super().push_days([self.region_view(values) for values in rows], finished)
+
+    def save_result(self, keys, hist_df):
+        pass
+
+    def show_region(self, attr, old, new):
+        # Days computed so far are replotted for the region, days still to come are streamed for it
+        if not self.region_days:
+            return
+        self.stream_history[:self.region_days] = self.region_view(self.engine.history[:self.region_days])
+        hist_df = self.derived_columns(pd.DataFrame(self.stream_history[:self.region_days],
+                                                    columns=self.history_keys, copy=False))
+        if self.hist_df is not None:
+            self.hist_df = hist_df
+        self.show_plot_data(hist_df)
@@ -0,0 +1,113 @@
+import os
+from functools import partial
+
+from bokeh.layouts import column
+from bokeh.models import TextInput, Panel, HoverTool
+
+from .plotting import DownsampledSource
+from .quarantine_two import QuarantineTwo
+from ..core.quarantine_two import QuarantineTwoStochasticEngine
+
+band_keys = ["S", "NI/RNT+RWT", "D", "IS-Total"]
+band_percentiles = [5, 25, 50, 75, 95]
+# Threads sharing the blocks of realizations of a run, results do not depend on it
+stochastic_workers = min(4, os.cpu_count() or 1)
+
+
+def band_column(key, percentile):
+    return "{} p{}".format(key, percentile)
+
+
+def band_columns(keys):
+    return [band_column(key, percentile) for key in keys for percentile in band_percentiles]
+
+
+class QuarantineTwoStochastic(QuarantineTwo):
+    """QuarantineTwo with random flows between whole numbers of people, see QuarantineTwoStochasticEngine.
+
+    Plots are fan charts of the realizations, with the median as the line and the 25-75 and 5-95 percentiles as
+    shaded bands. Runs are reproducible for the same seed and number of realizations, whatever the solver.
+    """
+    def __init__(self, engine_mode="vector", cache=None, store=None):
+        super().__init__(engine_mode, cache=cache, store=store)
+        # Rows of the engine are (percentiles, band_keys), streamed flattened in that order
+        self.history_keys = [band_column(key, percentile) for percentile in band_percentiles for key in band_keys]
+        self.plot_sources = [DownsampledSource("Day", band_columns(["S", "NI/RNT+RWT", "D"])),
+                             DownsampledSource("Day", band_columns(["IS-Total"])),
+                             DownsampledSource("Day", band_columns(["D"]))]
+        self.realizations_input = TextInput(value="1000", title="Realizations")
+        self.seed_input = TextInput(value="0", title="Seed")
+        self.realizations, self.seed = 1000, 0
+
+    def set_engine_mode(self, engine_mode):
+        # Realizations always take daily steps
+        self.engine_mode = engine_mode
+
+    def cache_name(self):
+        return type(self).__name__
+
+    def dynamic_control_panel(self):
+        control_panel = super().dynamic_control_panel()
+        realizations_panel = column(self.realizations_input, self.seed_input, sizing_mode="stretch_width")
+        control_panel.children[0].tabs.append(Panel(child=realizations_panel, title="Realizations"))
+        return control_panel
+
+    def realizations_inputs(self):
+        return int(float(self.realizations_input.value)), int(float(self.seed_input.value))
+
+    def set_realizations(self, realizations, seed):
+        self.realizations, self.seed = max(int(realizations), 1), int(seed)
+
+    def result_keys(self, population_initials_dict, spread_factors_dict):
+        return super().result_keys(population_initials_dict,
+                                   dict(spread_factors_dict, realizations=self.realizations, seed=self.seed))
+
+    def run_scenario(self, population_initials_dict, spread_factors_dict, realizations=1000, seed=0):
+        self.set_realizations(realizations, seed)
+        self.run_days(self.start_run(population_initials_dict, spread_factors_dict))
+
+    def start_streaming_run(self, control_panel, executor=None):
+        self.set_realizations(*self.realizations_inputs())
+        return super().start_streaming_run(control_panel, executor)
+
+    def engine_factory(self):
+        return partial(QuarantineTwoStochasticEngine, self.realizations, self.seed, band_percentiles, stochastic_workers,
+                       record_keys=band_keys)
+
+    def start_run(self, population_initials_dict, spread_factors_dict, executor=None):
+        self.engine = self.engine_factory()()
+        return super().start_run(population_initials_dict, spread_factors_dict, executor)
+
+    def push_days(self, rows, finished):
+        super().push_days([values.ravel() for values in rows], finished)
+
+    def derived_columns(self, hist_df):
+        # Sums of stocks are taken for every realization by the engine, before the percentiles
+        hist_df["Day"] = hist_df.index
+        return hist_df
+
+    def summary_values(self, hist_df):
+        return dict()
+
+    def build_figures(self, y_axis_type, x_ranges=None):
+        (p1, p2, p3), sources = self.new_figures(y_axis_type, x_ranges)
+
+        for p, source, keys, colors in ((p1, sources[0], ["S", "NI/RNT+RWT", "D"], ["blue", "green", "red"]),
+                                        (p2, sources[1], ["IS-Total"], ["blue"]),
+                                        (p3, sources[2], ["D"], ["red"])):
+            medians = []
+            for key, color in zip(keys, colors):
+                p.varea("Day", band_column(key, 5), band_column(key, 95), source=source, fill_color=color,
+                        fill_alpha=0.15, legend_label=key)
+                p.varea("Day", band_column(key, 25), band_column(key, 75), source=source, fill_color=color,
+                        fill_alpha=0.3, legend_label=key)
+                medians.append(p.line("Day", band_column(key, 50), source=source, line_color=color, legend_label=key))
+            p.add_tools(HoverTool(
+                tooltips=[('Day', '@Day')] + [
+                    (key, '@{{{}}}{{0.00 a}} (@{{{}}}{{0.00 a}} - @{{{}}}{{0.00 a}})'.format(
+                        band_column(key, 50), band_column(key, 5), band_column(key, 95))) for key in keys],
+                renderers=medians[:1],
+                # display a tooltip whenever the cursor is vertically in line with a glyph
+                mode='vline'
+            ))
+        return [p1, p2, p3]
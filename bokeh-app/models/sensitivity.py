@@ -0,0 +1,138 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+import numpy as np
+from bokeh.models import Slider
+
+from .quarantine_two import quarantine_two_controls
+from ..core.quarantine_two import QuarantineTwoVectorEngine, default_stocks, default_parameters, headline_outputs, \
+    headline_output_keys
+
+sensitivity_parameter_keys = [key for key in quarantine_two_controls.parameter_ui_params if key != "NumDays"]
+sensitivity_methods = ["Sobol", "Morris"]
+
+
+def default_bounds():
+    # Sliders are sampled over their whole range, free text inputs over +-50% of their default value
+    bounds = dict()
+    for key in sensitivity_parameter_keys:
+        ui_item = quarantine_two_controls.parameter_ui_params[key]
+        if ui_item["widget"] is Slider:
+            low, high = ui_item["kwargs"]["start"], ui_item["kwargs"]["end"]
+        else:
+            low, high = 0.5 * float(ui_item["kwargs"]["value"]), 1.5 * float(ui_item["kwargs"]["value"])
+        bounds[key] = (float(low) / ui_item["scale"], float(high) / ui_item["scale"])
+    return bounds
+
+
+def default_scenario():
+    return dict(default_stocks), dict(default_parameters)
+
+
+def saltelli_sample(n, k, rng):
+    # Rows are [A, B, AB_1, ..., AB_k] in the unit cube, AB_i is A with column i taken from B
+    A, B = rng.random((n, k)), rng.random((n, k))
+    AB = np.repeat(A[np.newaxis], k, axis=0)
+    for i in range(k):
+        AB[i, :, i] = B[:, i]
+    return np.concatenate([A, B, AB.reshape(n * k, k)])
+
+
+def sobol_indices(y, n, k):
+    # First-order (Saltelli 2010) and total (Jansen) estimators for outputs y of a saltelli_sample
+    f_A, f_B, f_AB = y[:n], y[n:2 * n], y[2 * n:].reshape(k, n, -1)
+    variance = np.var(np.concatenate([f_A, f_B]), axis=0)
+    variance = np.where(variance > 0, variance, np.nan)
+    first_order = np.mean(f_B * (f_AB - f_A), axis=1) / variance
+    total = 0.5 * np.mean((f_A - f_AB) ** 2, axis=1) / variance
+    return first_order, total
+
+
+def morris_sample(r, k, levels, rng):
+    # r one-at-a-time trajectories of k + 1 points on a grid of `levels` levels in the unit cube
+    delta = levels / (2 * (levels - 1))
+    grid = np.arange(levels // 2) / (levels - 1)
+    trajectories = np.empty((r, k + 1, k))
+    for t in range(r):
+        point = rng.choice(grid, size=k)
+        trajectories[t, 0] = point
+        for j, i in enumerate(rng.permutation(k)):
+            point = point.copy()
+            point[i] += delta
+            trajectories[t, j + 1] = point
+    return trajectories.reshape(r * (k + 1), k), delta
+
+
+def morris_indices(y, samples, r, k, delta):
+    # Mean absolute (mu*) and standard deviation (sigma) of the elementary effects of each parameter
+    y, samples = y.reshape(r, k + 1, -1), samples.reshape(r, k + 1, k)
+    effects = np.empty((r, k, y.shape[-1]))
+    for t in range(r):
+        moved = np.argmax(np.diff(samples[t], axis=0), axis=1)
+        effects[t, moved] = np.diff(y[t], axis=0) / delta
+    return np.mean(np.abs(effects), axis=0), np.std(effects, axis=0)
+
+
+def evaluate_samples(S, P, keys, values):
+    P = dict(P, **{key: values[:, i] for i, key in enumerate(keys)})
+    return headline_outputs(QuarantineTwoVectorEngine().run_batch(S, P))
+
+
+def run_sensitivity(method="Sobol", n=256, seed=0, S=None, P=None, bounds=None, chunk_size=256, max_workers=None,
+                    executor=None, progress=None):
+    """Sample the parameters in `bounds`, run the model for every sample and return the sensitivity indices.
+
+    S and P give the scenario the samples are taken around, `n` is the base sample size for Sobol and the number of
+    trajectories for Morris. Samples are evaluated in chunks of `chunk_size` on `executor`, or on a pool of
+    `max_workers` processes made for this call when it is None, and `progress(done, total)` is called after each
+    chunk. The result maps every headline output to its first-order ("S1") and total ("ST") Sobol indices, or to the
+    Morris "mu_star" and "sigma" of each parameter.
+    """
+    default_S, default_P = default_scenario()
+    S, P, bounds = S or default_S, P or default_P, bounds or default_bounds()
+    keys = list(bounds.keys())
+    k = len(keys)
+    rng = np.random.default_rng(seed)
+    if method == "Sobol":
+        unit_samples = saltelli_sample(n, k, rng)
+    elif method == "Morris":
+        unit_samples, delta = morris_sample(n, k, 4, rng)
+    else:
+        raise ValueError("Unknown sensitivity method {}, expected one of {}".format(method, sensitivity_methods))
+    low, high = np.array([bounds[key] for key in keys]).T
+    samples = low + unit_samples * (high - low)
+
+    y = np.empty((len(samples), len(headline_output_keys)))
+    chunks = [slice(start, start + chunk_size) for start in range(0, len(samples), chunk_size)]
+    done = 0
+    if max_workers == 1:
+        for chunk in chunks:
+            y[chunk] = evaluate_samples(S, P, keys, samples[chunk])
+            done += len(y[chunk])
+            if progress:
+                progress(done, len(samples))
+    else:
+        if executor is None:
+            pool = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count())
+        else:
+            # A shared pool stays up after the analysis
+            pool = nullcontext(executor)
+        with pool as executor:
+            futures = {executor.submit(evaluate_samples, S, P, keys, samples[chunk]): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                y[chunk] = future.result()
+                done += len(y[chunk])
+                if progress:
+                    progress(done, len(samples))
+
+    if method == "Sobol":
+        first, second = sobol_indices(y, n, k)
+        index_keys = ["S1", "ST"]
+    else:
+        first, second = morris_indices(y, unit_samples, n, k, delta)
+        index_keys = ["mu_star", "sigma"]
+    indices = {output: {index_keys[0]: first[:, j], index_keys[1]: second[:, j]}
+               for j, output in enumerate(headline_output_keys)}
+    return {"method": method, "parameters": keys, "indices": indices}
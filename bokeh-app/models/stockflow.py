@@ -0,0 +1,69 @@
+from bokeh.models import Slider, TextInput
+
+
+def ui_params(key, default, overrides):
+    # Widget of a stock or parameter, see StockFlowControls
+    value_type = int if isinstance(default, int) else float
+    ui_item = {"type": value_type, "scale": overrides.get("scale", 1)}
+    title = overrides.get("title", key)
+    if "range" in overrides:
+        start, end = overrides["range"]
+        ui_item.update(widget=Slider, kwargs={"start": start, "end": end, "step": overrides.get("step", 1),
+                                              "title": title})
+    else:
+        ui_item.update(widget=TextInput, kwargs={"title": title})
+    ui_item["kwargs"]["value"] = widget_value(ui_item, default)
+    return ui_item
+
+
+def widget_value(ui_item, value):
+    # Engine value as its widget shows it, rounded so that parsing the widget gives the value back
+    value = round(value * ui_item["scale"], 9)
+    if ui_item["widget"] is Slider:
+        return float(value)
+    return str(int(value)) if ui_item["type"] is int else "{:.6g}".format(value)
+
+
+class StockFlowControls:
+    """Control panel widgets of a StockFlowModel, generated from its input stocks and parameters.
+
+    `stocks` and `parameters` are the default values of the spec's input stocks and parameters, in the same order.
+    Each one is a TextInput titled by its name, unless `ui_overrides` of the name gives a "title", a "range" (start,
+    end) that makes it a Slider with a "step" of 1 by default, or a "scale" the widget shows the value multiplied by,
+    such as 100 for percentages.
+    """
+    def __init__(self, spec, stocks, parameters, ui_overrides=None):
+        if list(stocks) != spec.input_stocks or list(parameters) != spec.parameters:
+            raise ValueError("Widgets of {} do not match its input stocks and parameters".format(spec.name))
+        ui_overrides = dict(ui_overrides or {})
+        unknown = [key for key in ui_overrides if key not in stocks and key not in parameters]
+        if unknown:
+            raise ValueError("{} has no input stocks or parameters {}".format(spec.name, ", ".join(unknown)))
+        self.spec = spec
+        self.stock_ui_params = {key: ui_params(key, int(value), ui_overrides.get(key, {}))
+                                for key, value in stocks.items()}
+        self.parameter_ui_params = {key: ui_params(key, value, ui_overrides.get(key, {}))
+                                    for key, value in parameters.items()}
+
+    def stock_widgets(self):
+        return [ui_item["widget"](id=id, **ui_item["kwargs"]) for id, ui_item in self.stock_ui_params.items()]
+
+    def parameter_widgets(self):
+        return [ui_item["widget"](id=id, **ui_item["kwargs"]) for id, ui_item in self.parameter_ui_params.items()]
+
+    def parse_widgets(self, stock_widgets, parameter_widgets):
+        population_initials_dict = {key: int(widget.value) for key, widget in zip(self.stock_ui_params, stock_widgets)}
+        parameters_dict = dict()
+        for (key, ui_item), widget in zip(self.parameter_ui_params.items(), parameter_widgets):
+            new_value = ui_item["type"](widget.value)
+            parameters_dict[key] = new_value / ui_item["scale"] if ui_item["scale"] != 1 else new_value
+        return population_initials_dict, parameters_dict
+
+    def set_widgets(self, stock_widgets, parameter_widgets, S, P):
+        # Inverse of parse_widgets for the keys present in S and P
+        for (key, ui_item), widget in zip(self.stock_ui_params.items(), stock_widgets):
+            if key in S:
+                widget.value = widget_value(ui_item, int(round(S[key])))
+        for (key, ui_item), widget in zip(self.parameter_ui_params.items(), parameter_widgets):
+            if key in P:
+                widget.value = widget_value(ui_item, P[key])
@@ -0,0 +1,55 @@
+"""Serve the dashboard like `bokeh serve bokeh-app`, optionally with a Prometheus /metrics endpoint.
+
+    cd bokeh-app && python serve.py --metrics --num-procs 4
+
+Every server process keeps its own metrics, /metrics answers with those of the process that takes the request.
+"""
+import argparse
+import os
+import sys
+from importlib import import_module
+
+APP_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_app():
+    # The app modules use relative imports, so they are loaded as the package `bokeh serve` makes of the directory
+    from bokeh.application.handlers.directory import DirectoryHandler
+    handler = DirectoryHandler(filename=APP_DIRECTORY)
+    if handler.failed:
+        raise RuntimeError(handler.error)
+    # The handler registers its package last, pytest may have imported the same file under another name before
+    package_name = [name for name, module in list(sys.modules.items())
+                    if getattr(module, "__file__", None) == os.path.join(APP_DIRECTORY, "__init__.py")][-1]
+    return handler, package_name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the 2019-nCov dashboard.")
+    parser.add_argument("--port", type=int, default=5006)
+    parser.add_argument("--num-procs", type=int, default=1)
+    parser.add_argument("--allow-websocket-origin", nargs="*", default=None)
+    parser.add_argument("--metrics", action="store_true",
+                        help="time the hot paths and serve them in the Prometheus text format at /metrics")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        # Read when the app modules are imported below
+        os.environ["NCOV_METRICS"] = "1"
+    from bokeh.application import Application
+    from bokeh.server.server import Server
+
+    handler, package_name = load_app()
+    extra_patterns = []
+    if args.metrics:
+        metrics = import_module(package_name + ".core.metrics")
+        extra_patterns.append((r"/metrics", metrics.metrics_handler()))
+    server = Server({"/bokeh-app": Application(handler)}, port=args.port, num_procs=args.num_procs,
+                    allow_websocket_origin=args.allow_websocket_origin, extra_patterns=extra_patterns)
+    server.start()
+    print("Serving http://localhost:{}/bokeh-app".format(args.port), flush=True)
+    server.io_loop.start()
+
+
+if __name__ == "__main__":
+    main()
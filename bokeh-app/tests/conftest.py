@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The engines are imported as the top-level package `core`, like benchmarks.py and `python -m core.batch` do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app_package():
+    # The dashboard modules use relative imports, they are loaded as the package `bokeh serve` makes of the directory
+    from serve import load_app
+    handler, package_name = load_app()
+    return package_name
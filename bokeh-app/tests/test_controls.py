@@ -0,0 +1,54 @@
+from importlib import import_module
+
+import pytest
+from bokeh.models import Slider, TextInput
+
+from core.basic import default_stocks as basic_stocks, default_parameters as basic_parameters
+from core.quarantine_two import quarantine_two_spec, default_stocks, default_parameters
+
+
+@pytest.fixture(scope="module")
+def stockflow(app_package):
+    return import_module(app_package + ".models.stockflow")
+
+
+@pytest.fixture(scope="module")
+def controls(app_package):
+    return {"quarantine_two": import_module(app_package + ".models.quarantine_two").quarantine_two_controls,
+            "basic": import_module(app_package + ".models.basic").basic_controls}
+
+
+def test_widgets_are_generated_from_defaults_and_overrides(controls):
+    stock_widgets = controls["quarantine_two"].stock_widgets()
+    parameter_widgets = {widget.id: widget for widget in controls["quarantine_two"].parameter_widgets()}
+    assert [widget.id for widget in stock_widgets] == list(default_stocks)
+    assert isinstance(stock_widgets[0], TextInput) and stock_widgets[0].value == "7278717"
+    assert parameter_widgets["x"].value == "1e-05" and parameter_widgets["x"].title == "x: % of No-Symptom Tested"
+    p_a = parameter_widgets["p_a"]
+    assert isinstance(p_a, Slider) and (p_a.start, p_a.end, p_a.step, p_a.value) == (0, 100, 1, 60)
+    assert parameter_widgets["NumDays"].step == 10
+    # Names without overrides are text inputs titled by the name
+    assert controls["basic"].parameter_widgets()[0].title == "R0"
+
+
+@pytest.mark.parametrize("name, S, P", [("quarantine_two", default_stocks, default_parameters),
+                                        ("basic", basic_stocks, basic_parameters)])
+def test_default_widgets_parse_to_the_default_scenario(controls, name, S, P):
+    # Exactly, so that the default scenario is found in the result store
+    assert controls[name].parse_widgets(controls[name].stock_widgets(), controls[name].parameter_widgets()) == (S, P)
+
+
+def test_set_widgets_is_the_inverse_of_parse_widgets(controls):
+    quarantine_two_controls = controls["quarantine_two"]
+    stock_widgets = quarantine_two_controls.stock_widgets()
+    parameter_widgets = quarantine_two_controls.parameter_widgets()
+    S, P = dict(default_stocks, IS=25), dict(default_parameters, beta=0.25, p_r=0.97, t_d=5.0)
+    quarantine_two_controls.set_widgets(stock_widgets, parameter_widgets, S, P)
+    assert quarantine_two_controls.parse_widgets(stock_widgets, parameter_widgets) == (S, P)
+
+
+def test_overrides_of_unknown_names_are_rejected(stockflow):
+    with pytest.raises(ValueError):
+        stockflow.StockFlowControls(quarantine_two_spec, default_stocks, default_parameters, {"gamma": {"title": "g"}})
+    with pytest.raises(ValueError):
+        stockflow.StockFlowControls(quarantine_two_spec, default_stocks, dict(default_parameters, gamma=1.0))
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from core.downsample import lttb_indices, min_max_indices, downsample_indices, downsample_methods
+
+x = np.arange(10000, dtype=float)
+y = np.sin(x / 500)
+spiky = y.copy()
+spiky[4321], spiky[7777] = 50.0, -50.0
+
+
+def test_lttb_keeps_endpoints_and_spikes():
+    indices = lttb_indices(x, spiky, 800)
+    assert len(indices) == 800
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert np.all(np.diff(indices) > 0)
+    assert {4321, 7777} <= set(indices)
+
+
+def test_min_max_keeps_endpoints_and_extremes_of_every_bucket():
+    indices = min_max_indices(x, spiky, 800)
+    assert len(indices) <= 800 + 2
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert np.all(np.diff(indices) > 0)
+    assert {4321, 7777} <= set(indices)
+    assert {int(np.argmax(y)), int(np.argmin(y))} <= set(min_max_indices(x, y, 800))
+
+
+def test_min_max_handles_buckets_without_values():
+    values = spiky.copy()
+    values[:2000] = np.nan
+    indices = min_max_indices(x, values, 800)
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert np.all(np.diff(indices) > 0)
+    assert {4321, 7777} <= set(indices)
+
+
+@pytest.mark.parametrize("method", sorted(downsample_methods))
+def test_short_series_are_kept_whole(method):
+    assert np.array_equal(downsample_methods[method](x[:500], y[:500], 800), np.arange(500))
+    assert np.array_equal(downsample_indices(x[:500], [y[:500]], 800, method), np.arange(500))
+
+
+@pytest.mark.parametrize("method", sorted(downsample_methods))
+def test_window_adds_detail_inside_it_and_keeps_the_overview(method):
+    overview = downsample_indices(x, [y, spiky], 800, method)
+    zoomed = downsample_indices(x, [y, spiky], 800, method, window=(2000.0, 2500.0))
+    assert set(overview) <= set(zoomed)
+    inside = zoomed[(x[zoomed] >= 2000) & (x[zoomed] <= 2500)]
+    # The 501 points of the window are fewer than the budget, so all of them are shown
+    assert np.array_equal(inside, np.arange(2000, 2501))
+    # One more point past each end of the window
+    assert {1999, 2501} <= set(zoomed)
+    assert np.all(np.diff(zoomed) > 0)
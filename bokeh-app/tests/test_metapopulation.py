@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from core.metapopulation import QuarantineTwoMetapopulationEngine, mobility_matrix
+from core.quarantine_two import QuarantineTwoVectorEngine, default_stocks, default_parameters
+
+
+def test_regions_without_travel_run_as_independent_models():
+    S = dict(default_stocks, S=np.array([7278717.0, 1e6, 5e4]), IS=np.array([10.0, 100.0, 0.0]))
+    P = dict(default_parameters, NumDays=365, beta=np.array([0.304, 0.2, 0.5]), t_d=2.0)
+    engine = QuarantineTwoMetapopulationEngine(mobility_matrix([], [], [], 3))
+    engine.run(S, P)
+    assert engine.history.shape == (365, 3, len(engine.record_keys))
+    for region in range(3):
+        single = QuarantineTwoVectorEngine()
+        single.run({key: np.broadcast_to(value, (3,))[region] for key, value in S.items()},
+                   dict(P, beta=P["beta"][region]))
+        assert single.record_keys == engine.record_keys
+        assert np.allclose(engine.history[:, region, :], single.history, rtol=1e-12, atol=1e-12)
+
+
+def test_mobility_matrix_keeps_the_rest_of_the_time_at_home():
+    mobility = mobility_matrix([0, 0, 1, 2], [1, 2, 0, 2], [0.1, 0.2, 0.05, 0.3], 3).toarray()
+    # A share from a region to itself is ignored
+    assert np.allclose(mobility, [[0.7, 0.1, 0.2], [0.05, 0.95, 0], [0, 0, 1]])
+
+
+@pytest.mark.parametrize("shares", [[0.6, 0.5], [-0.1, 0.2]], ids=["more than 1", "negative"])
+def test_mobility_matrix_rejects_invalid_shares(shares):
+    with pytest.raises(ValueError, match="Mobility shares"):
+        mobility_matrix([0, 0], [1, 2], shares, 3)
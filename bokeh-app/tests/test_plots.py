@@ -0,0 +1,27 @@
+from importlib import import_module
+
+import pytest
+from bokeh.models import LinearScale, LogScale
+from bokeh.plotting import Figure
+
+
+def visible_y_scales(plot_panel):
+    return [type(p.y_scale) for p in plot_panel.select({"type": Figure}) if p.visible]
+
+
+@pytest.mark.parametrize("module_name, class_name", [("quarantine_two", "QuarantineTwo"),
+                                                     ("quarantine_two_stochastic", "QuarantineTwoStochastic")])
+def test_y_scale_shows_the_figures_of_its_axis_type(app_package, module_name, class_name):
+    model = getattr(import_module(app_package + ".models." + module_name), class_name)()
+    plot_panel = model.plot_panel("log")
+    assert visible_y_scales(plot_panel) == [LogScale] * 3
+
+    model.set_y_scale("linear")
+    assert visible_y_scales(plot_panel) == [LinearScale] * 3
+
+    model.set_y_scale("log")
+    assert visible_y_scales(plot_panel) == [LogScale] * 3
+    # Both axis types are drawn from the same sources
+    for linear, log in zip(model.plot_figures["linear"], model.plot_figures["log"]):
+        assert linear.x_range is log.x_range
+        assert {r.data_source for r in linear.renderers} == {r.data_source for r in log.renderers}
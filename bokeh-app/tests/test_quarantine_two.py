@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+from core.quarantine_two import QuarantineTwoEngine, QuarantineTwoVectorEngine, default_stocks, default_parameters
+
+
+@pytest.mark.parametrize("parameters", [{}, {"t_d": 1.0, "t_l": 1.0}], ids=["default", "short delays"])
+def test_vector_engine_matches_dict_engine(parameters):
+    P = dict(default_parameters, NumDays=760, **parameters)
+    dict_engine, vector_engine = QuarantineTwoEngine(), QuarantineTwoVectorEngine()
+    dict_engine.run(dict(default_stocks), dict(P))
+    vector_engine.run(dict(default_stocks), dict(P))
+    expected, actual = dict_engine.history_as_pandas_df(), vector_engine.history_as_pandas_df()
+    assert list(actual.columns) == list(expected.columns)
+    assert actual.shape == (760, len(expected.columns))
+    assert np.allclose(actual.values, expected.values, rtol=1e-12, atol=0)
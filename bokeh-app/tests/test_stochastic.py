@@ -0,0 +1,47 @@
+import numpy as np
+
+from core.quarantine_two import QuarantineTwoStochasticEngine, QuarantineTwoVectorEngine, quarantine_two_spec, \
+    default_stocks, default_parameters
+
+
+def run(P, **kwargs):
+    engine = QuarantineTwoStochasticEngine(**kwargs)
+    engine.run(dict(default_stocks), P)
+    return engine
+
+
+def test_bands_do_not_depend_on_the_number_of_workers():
+    # 1200 realizations are three blocks, shared among the threads in a different way
+    P = dict(default_parameters, NumDays=100)
+    one, four = run(P, realizations=1200, seed=7, workers=1), run(P, realizations=1200, seed=7, workers=4)
+    assert np.array_equal(one.history, four.history)
+
+
+def test_bands_change_with_the_seed():
+    P = dict(default_parameters, NumDays=100)
+    assert not np.array_equal(run(P, realizations=200, seed=1).history, run(P, realizations=200, seed=2).history)
+
+
+def test_history_keeps_only_the_percentiles():
+    P = dict(default_parameters, NumDays=50)
+    engine = run(P, realizations=1500, percentiles=(5, 50, 95), record_keys=["S", "D", "IS-Total"])
+    assert engine.history.shape == (50, 3, 3)
+    assert np.all(np.diff(engine.history, axis=1) >= 0)
+
+
+def test_median_stays_near_the_deterministic_run():
+    P = dict(default_parameters, NumDays=200)
+    stochastic = run(P, realizations=1000, seed=0, record_keys=["D", "IS-Total"])
+    deterministic = QuarantineTwoVectorEngine(record_keys=["D"])
+    deterministic.run(dict(default_stocks), P)
+    median = stochastic.history_as_pandas_df(50)
+    assert abs(median["D"].iloc[-1] - deterministic.history[-1, 0]) < 0.01 * deterministic.history[-1, 0]
+
+
+def test_stocks_are_whole_and_never_negative():
+    # Short delays and heavy testing, so the daily fractions leaving some stocks add up to more than 1
+    P = dict(default_parameters, NumDays=60, t_d=1.0, t_i=1.0, t_p=1.0, x=0.5, y=1.0, beta=2.0)
+    engine = run(P, realizations=600, seed=0, percentiles=(0,), record_keys=quarantine_two_spec.stocks)
+    minimum = engine.history[:, 0, :]
+    assert np.all(minimum >= 0)
+    assert np.array_equal(minimum, np.round(minimum))
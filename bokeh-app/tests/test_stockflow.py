@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from core.basic import BasicEngine, BasicVectorEngine, basic_spec
+from core.quarantine_two import QuarantineTwoEngine, QuarantineTwoVectorEngine, QuarantineTwoODEEngine, \
+    quarantine_two_spec, default_stocks, default_parameters
+from core.stockflow import Flow, StockFlowModel, StockFlowEngine
+
+basic_stocks = {"S": 7278717, "IA": 300, "IPs": 300, "ISHome": 66, "ISHosp": 34}
+basic_parameters = {"R0": 0.304, "SAR": 0.6, "InfAR": 0.5, "TtSO": 5, "SCHR": 0.33, "DR": 0.02, "NDtRI": 14,
+                    "RBR": 0.35, "ICUR": 0.2, "NumDays": 365}
+
+
+def test_quarantine_two_batch_rows_match_dict_engine():
+    betas, t_ds = np.array([0.1, 0.304, 0.5]), np.array([1.0, 3.0, 14.0])
+    P = dict(default_parameters, NumDays=365, beta=betas, t_d=t_ds)
+    histories = QuarantineTwoVectorEngine().run_batch(default_stocks, P)
+    assert histories.shape == (3, 365, len(QuarantineTwoEngine().record_keys))
+    for history, beta, t_d in zip(histories, betas, t_ds):
+        engine = QuarantineTwoEngine()
+        engine.run(dict(default_stocks), dict(default_parameters, NumDays=365, beta=beta, t_d=t_d))
+        assert np.allclose(history, engine.history, rtol=1e-12, atol=0)
+
+
+def test_basic_vector_engine_matches_dict_engine():
+    dict_engine, vector_engine = BasicEngine(), BasicVectorEngine()
+    dict_engine.run(dict(basic_stocks), **basic_parameters)
+    vector_engine.run(dict(basic_stocks), **basic_parameters)
+    hist_df = vector_engine.history_as_pandas_df()
+    assert set(hist_df.columns) == set(dict_engine.history)
+    for key, values in dict_engine.history.items():
+        assert np.allclose(hist_df[key].values, values, rtol=1e-12, atol=0), key
+
+
+def test_basic_batch_rows_match_dict_engine():
+    R0s = np.array([0.1, 0.304, 0.9])
+    vector_engine = BasicVectorEngine()
+    histories = vector_engine.run_batch(basic_stocks, **dict(basic_parameters, R0=R0s))
+    for history, R0 in zip(histories, R0s):
+        dict_engine = BasicEngine()
+        dict_engine.run(dict(basic_stocks), **dict(basic_parameters, R0=R0))
+        expected = np.array([dict_engine.history[key] for key in vector_engine.record_keys]).T
+        assert np.allclose(history, expected, rtol=1e-12, atol=0)
+
+
+def decay_model(**kwargs):
+    arguments = dict(name="Decay", stocks=["A", "B"], input_stocks=["A"], parameters=["k", "NumDays"],
+                     auxiliaries=[("Total", "A + B")], flows=[Flow("A", "B", "k * A")])
+    arguments.update(kwargs)
+    return StockFlowModel(**arguments)
+
+
+def test_generated_step_moves_flows_between_stocks():
+    spec = decay_model(record_flows=True, derived_parameters={"A0": "A"})
+    assert spec.history_keys == ["A", "B", "A->B", "Total"]
+    engine = StockFlowEngine(spec)
+    engine.run({"A": 100.0}, {"k": 0.1, "NumDays": 3})
+    assert np.allclose(engine.history, [[100, 0, 10, 100], [90, 10, 9, 100], [81, 19, 8.1, 100]])
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    ({"flows": [Flow("A", "B", "k * A * missing")]}, "Unknown names"),
+    ({"auxiliaries": [("Total", "A + C")]}, "Unknown names"),
+    ({"derived_parameters": {"A0": "k"}}, "Unknown names"),
+    ({"flows": [Flow("A", "C", "k * A")]}, "unknown stock 'C'"),
+    ({"flows": [Flow("C", None, "k")]}, "unknown stock 'C'"),
+    ({"auxiliaries": [("k", "A + B")]}, "shadows"),
+    ({"stocks": ["A", "B", "not a name"]}, "not an identifier"),
+], ids=["flow name", "auxiliary name", "derived parameter name", "flow target", "flow source", "shadowing",
+        "stock name"])
+def test_invalid_models_raise_value_error(kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        decay_model(**kwargs)
+
+
+def dense_jacobian(spec, jacobian, stocks):
+    matrix = np.zeros((len(stocks), len(stocks)))
+    matrix[spec.jacobian_rows, spec.jacobian_columns] = np.array(jacobian(*stocks), dtype=float)
+    return matrix
+
+
+def central_differences(rates, stocks):
+    matrix = np.empty((len(stocks), len(stocks)))
+    for j in range(len(stocks)):
+        step = 1e-4 * max(1.0, abs(stocks[j]))
+        up, down = stocks.copy(), stocks.copy()
+        up[j] += step
+        down[j] -= step
+        matrix[:, j] = (np.array(np.broadcast_arrays(*rates(*up)), dtype=float) -
+                        np.array(np.broadcast_arrays(*rates(*down)), dtype=float)) / (2 * step)
+    return matrix
+
+
+@pytest.mark.parametrize("spec, S, P", [
+    (quarantine_two_spec, default_stocks, dict(default_parameters)),
+    (basic_spec, basic_stocks, dict(basic_parameters, NumDays=200)),
+], ids=["quarantine two", "basic"])
+def test_jacobian_matches_central_differences(spec, S, P):
+    # States along a run, where every stock has left its initial value
+    engine = StockFlowEngine(spec)
+    engine.run(S, P)
+    initial_stocks = engine.initial_stocks(S)
+    rates, jacobian = spec.bind_rates(dict(P, **spec.initial_parameters(*initial_stocks)))
+    for day in (0, 30, 100, 199):
+        stocks = engine.history[day, :len(spec.stocks)].copy()
+        analytic = dense_jacobian(spec, jacobian, stocks)
+        numeric = central_differences(rates, stocks)
+        assert np.abs(analytic - numeric).max() <= 1e-6 * np.abs(analytic).max(), day
+
+
+def test_lsoda_and_bdf_agree():
+    P = dict(default_parameters, NumDays=365)
+    lsoda, bdf = QuarantineTwoODEEngine("LSODA"), QuarantineTwoODEEngine("BDF")
+    lsoda.run(dict(default_stocks), dict(P))
+    bdf.run(dict(default_stocks), dict(P))
+    scale = np.maximum(np.abs(lsoda.history).max(axis=0), 1)
+    assert np.all(np.abs(lsoda.history - bdf.history).max(axis=0) <= 1e-4 * scale)
@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+
+from core.store import ResultStore, source_version
+
+S, P = {"S": 100, "IS": 10}, {"beta": 0.3, "NumDays": 200}
+
+
+def test_key_depends_on_version_and_not_on_number_types(tmp_path):
+    store = ResultStore(str(tmp_path), version="a")
+    key = store.key("QuarantineTwo/vector", S, P)
+    assert key == store.key("QuarantineTwo/vector", {"S": 100.0, "IS": 10.0}, dict(P, NumDays=200.0))
+    assert key != store.key("QuarantineTwo/bdf", S, P)
+    assert key != ResultStore(str(tmp_path), version="b").key("QuarantineTwo/vector", S, P)
+
+
+def test_results_of_other_versions_are_not_read_back(tmp_path):
+    history = np.arange(12.0).reshape(4, 3)
+    old, new = ResultStore(str(tmp_path), version="old"), ResultStore(str(tmp_path), version="new")
+    old.put(old.key("QuarantineTwo/vector", S, P), history)
+    assert np.array_equal(old.get(old.key("QuarantineTwo/vector", S, P)), history)
+    assert new.get(new.key("QuarantineTwo/vector", S, P)) is None
+
+
+def test_source_version_changes_with_the_sources(tmp_path):
+    (tmp_path / "engine.py").write_text("rate = 1\n")
+    (tmp_path / "notes.txt").write_text("not code\n")
+    version = source_version(str(tmp_path))
+    (tmp_path / "notes.txt").write_text("still not code\n")
+    assert source_version(str(tmp_path)) == version
+    (tmp_path / "engine.py").write_text("rate = 2\n")
+    assert source_version(str(tmp_path)) != version
+
+
+def test_writing_an_existing_result_keeps_it_from_eviction(tmp_path):
+    history = np.zeros((100, 10))
+    store = ResultStore(str(tmp_path), max_bytes=2 * history.nbytes + 1024, version="a")
+    old, new = store.key("QuarantineTwo/vector", S, P), store.key("QuarantineTwo/vector", S, dict(P, beta=0.4))
+    store.put(old, history)
+    store.put(new, history)
+    os.utime(store.path(old), (0, 0))
+    os.utime(store.path(new), (1, 1))
+    # The old result is the most recently used once it is written again, the third result evicts the new one
+    store.put(old, history)
+    store.put(store.key("QuarantineTwo/vector", S, dict(P, beta=0.5)), history)
+    assert os.path.exists(store.path(old)) and not os.path.exists(store.path(new))
@@ -0,0 +1,41 @@
+from functools import partial
+
+import numpy as np
+import pytest
+
+from core.quarantine_two import default_stocks, default_parameters, QuarantineTwoVectorEngine, \
+    QuarantineTwoStochasticEngine
+from core.streams import StreamPool
+
+P = dict(default_parameters, NumDays=300)
+
+
+@pytest.fixture(scope="module")
+def engine_pool():
+    pool = StreamPool(max_workers=2)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+@pytest.mark.parametrize("engine_factory", [QuarantineTwoVectorEngine,
+                                            partial(QuarantineTwoStochasticEngine, 50, 3, record_keys=["S", "D"])])
+def test_streamed_days_are_the_days_of_the_engine(engine_pool, engine_factory):
+    days = list(engine_pool.iter_run(engine_factory, dict(default_stocks), dict(P)))
+    expected = list(engine_factory().iter_run(dict(default_stocks), dict(P)))
+    assert len(days) == P["NumDays"]
+    assert np.array_equal(np.stack(days), np.stack(expected))
+
+
+def test_closed_runs_stop_and_free_their_worker(engine_pool):
+    days = engine_pool.iter_run(QuarantineTwoVectorEngine, dict(default_stocks), dict(P, NumDays=10 ** 7))
+    next(days)
+    days.close()
+    # Both workers are free again for runs of every length
+    runs = [engine_pool.iter_run(QuarantineTwoVectorEngine, dict(default_stocks), dict(P)) for _ in range(2)]
+    assert [len(list(run)) for run in runs] == [P["NumDays"]] * 2
+
+
+def test_errors_of_the_worker_are_raised(engine_pool):
+    with pytest.raises(KeyError):
+        list(engine_pool.iter_run(QuarantineTwoVectorEngine, dict(default_stocks), {"NumDays": 10}))